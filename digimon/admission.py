@@ -0,0 +1,174 @@
+import asyncio
+import collections
+import ipaddress
+import json
+import logging
+import math
+import time
+
+from . import config
+from . import deps
+from . import pooling
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        # 0 when a token was taken, otherwise seconds until one is available
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token bucket per key, the least recently seen keys are dropped past
+    `max_keys` (a dropped key simply starts again with a full bucket)."""
+
+    def __init__(self, rate: float, burst: int, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+
+        self._buckets: collections.OrderedDict[str, TokenBucket] = (
+            collections.OrderedDict()
+        )
+
+    def take(self, key: str) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+
+        return bucket.take()
+
+
+def route_class(scope) -> str:
+    # /token spends most of its time in bcrypt, reads and writes hold the pool
+    # for different lengths of time
+    if scope["path"] == "/token":
+        return "auth"
+    if scope["method"] in ("GET", "HEAD", "OPTIONS"):
+        return "read"
+    return "write"
+
+
+class AdmissionMiddleware:
+    """Rejects work early instead of letting it queue into timeouts:
+    429 when a user/IP is over its rate, 503 when its route class is at its
+    concurrency limit or the connection pool is saturated."""
+
+    def __init__(self, app, settings: config.Settings):
+        self.app = app
+        self.settings = settings
+
+        self.rate_limiter = (
+            RateLimiter(
+                settings.RATE_LIMIT_PER_SECOND,
+                settings.RATE_LIMIT_BURST,
+                settings.RATE_LIMIT_MAX_KEYS,
+            )
+            if settings.RATE_LIMIT_PER_SECOND > 0
+            else None
+        )
+        self.trusted_proxies = [
+            ipaddress.ip_network(proxy, strict=False)
+            for proxy in settings.TRUSTED_PROXIES
+        ]
+        self.semaphores = {
+            name: asyncio.Semaphore(limit)
+            for name, limit in settings.CONCURRENCY_LIMITS.items()
+        }
+        self.queue_timeout = settings.CONCURRENCY_QUEUE_TIMEOUT_MS / 1000
+        self.pool_wait_threshold = settings.POOL_WAIT_SHED_THRESHOLD_MS / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.rate_limiter is not None:
+            retry_after = self.rate_limiter.take(self.client_key(scope))
+            if retry_after:
+                await self.reject(send, 429, "Too many requests", retry_after)
+                return
+
+        if pooling.pool_wait.current() > self.pool_wait_threshold:
+            logger.warning("shedding %s %s", scope["method"], scope["path"])
+            await self.reject(send, 503, "Service overloaded", 1)
+            return
+
+        semaphore = self.semaphores.get(route_class(scope))
+        if semaphore is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            await self.reject(send, 503, "Service overloaded", 1)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            semaphore.release()
+
+    def client_key(self, scope) -> str:
+        headers = dict(scope["headers"])
+        authorization = headers.get(b"authorization", b"")
+        subject = deps.get_token_subject(authorization.decode("latin-1"))
+        if subject:
+            return f"user:{subject}"
+
+        client = scope.get("client")
+        forwarded = headers.get(b"x-forwarded-for", b"").decode("latin-1")
+        return f"ip:{self.client_ip(client[0] if client else None, forwarded)}"
+
+    def is_trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def client_ip(self, peer: str | None, forwarded: str) -> str:
+        # walks X-Forwarded-For from the right while the hop is a trusted
+        # proxy, the first untrusted hop is the client; anything left of it
+        # is whatever the client chose to send
+        address = peer
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        while address is not None and self.is_trusted(address) and hops:
+            address = hops.pop()
+        return address or "unknown"
+
+    async def reject(self, send, status_code: int, detail: str, retry_after: float):
+        body = json.dumps({"detail": detail}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status_code,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(math.ceil(retry_after)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,205 @@
+import datetime
+import gzip
+import json
+import os
+import pathlib
+from typing import Iterator
+
+from . import config
+
+settings = config.get_settings()
+
+MANIFEST = "manifest.json"
+
+
+def month_key(month: datetime.datetime) -> str:
+    return month.strftime("%Y-%m")
+
+
+def archive_dir() -> pathlib.Path:
+    return pathlib.Path(settings.ARCHIVE_DIR)
+
+
+# (file identity, manifest, cutoff) of the last manifest read; the manifest
+# is only ever replaced as a whole, so a new inode or mtime means a new one
+_manifest_cache: tuple = (None, {}, None)
+
+
+def _load_manifest() -> tuple[dict, datetime.datetime | None]:
+    global _manifest_cache
+    path = archive_dir() / MANIFEST
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return {}, None
+
+    identity = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _manifest_cache[0] != identity:
+        with open(path) as f:
+            manifest = json.load(f)
+        ends = [entry["end"] for entry in manifest.values() if entry["count"]]
+        _manifest_cache = (
+            identity,
+            manifest,
+            datetime.datetime.fromisoformat(max(ends)) if ends else None,
+        )
+    return _manifest_cache[1], _manifest_cache[2]
+
+
+def read_manifest() -> dict:
+    # month ("2024-01") -> dict(file, start, end, min_id, max_id, count),
+    # shared between callers, do not modify
+    return _load_manifest()[0]
+
+
+class MonthWriter:
+    """Writes one closed month as gzip-compressed NDJSON, fed in chunks.
+    The file and then the manifest are replaced atomically on close, so
+    re-running after a crash is safe."""
+
+    def __init__(self, month: datetime.datetime, end: datetime.datetime):
+        self.month = month
+        self.end = end
+        self.name = f"transaction-{month_key(month)}.ndjson.gz"
+        self.entry = None
+
+        self._count, self._min_id, self._max_id = 0, None, None
+
+    def __enter__(self):
+        self._directory = archive_dir()
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._tmp_path = self._directory / f".{self.name}.tmp"
+        self._file = gzip.open(self._tmp_path, "wt", encoding="utf-8")
+        return self
+
+    def write(self, rows: list[dict]):
+        for row in rows:
+            self._file.write(json.dumps(row, default=datetime.datetime.isoformat))
+            self._file.write("\n")
+            self._count += 1
+            if self._min_id is None or row["id"] < self._min_id:
+                self._min_id = row["id"]
+            if self._max_id is None or row["id"] > self._max_id:
+                self._max_id = row["id"]
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is not None:
+            self._tmp_path.unlink(missing_ok=True)
+            return
+
+        _fsync(self._tmp_path)
+        os.replace(self._tmp_path, self._directory / self.name)
+
+        self.entry = dict(
+            file=self.name,
+            start=self.month.isoformat(),
+            end=self.end.isoformat(),
+            min_id=self._min_id,
+            max_id=self._max_id,
+            count=self._count,
+        )
+        manifest = dict(read_manifest())
+        manifest[month_key(self.month)] = self.entry
+
+        tmp_manifest = self._directory / f".{MANIFEST}.tmp"
+        with open(tmp_manifest, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        _fsync(tmp_manifest)
+        os.replace(tmp_manifest, self._directory / MANIFEST)
+
+
+def _fsync(path: pathlib.Path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def cutoff() -> datetime.datetime | None:
+    # Everything created before this lives in the archive, not the hot table.
+    # Called on every history request, a stat() of the manifest unless it
+    # changed.
+    return _load_manifest()[1]
+
+
+def _read_file(entry: dict) -> Iterator[dict]:
+    with gzip.open(archive_dir() / entry["file"], "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            row["created_at"] = datetime.datetime.fromisoformat(row["created_at"])
+            yield row
+
+
+def _entries(
+    since: datetime.datetime | None, until: datetime.datetime | None
+) -> Iterator[dict]:
+    # manifest entries of the months overlapping [since, until), oldest first
+    for _, entry in sorted(read_manifest().items()):
+        if not entry["count"]:
+            continue
+        if since and datetime.datetime.fromisoformat(entry["end"]) <= since:
+            continue
+        if until and datetime.datetime.fromisoformat(entry["start"]) >= until:
+            continue
+        yield entry
+
+
+def _covers(
+    entry: dict, since: datetime.datetime | None, until: datetime.datetime | None
+) -> bool:
+    # whether the whole month lies in [since, until), its count is then exact
+    return (
+        not since or since <= datetime.datetime.fromisoformat(entry["start"])
+    ) and (not until or datetime.datetime.fromisoformat(entry["end"]) <= until)
+
+
+def _read_range(
+    entry: dict, since: datetime.datetime | None, until: datetime.datetime | None
+) -> Iterator[dict]:
+    for row in _read_file(entry):
+        if since and row["created_at"] < since:
+            continue
+        if until and row["created_at"] >= until:
+            continue
+        yield row
+
+
+def read(
+    since: datetime.datetime | None = None, until: datetime.datetime | None = None
+) -> Iterator[dict]:
+    # archived rows created in [since, until), oldest month first
+    for entry in _entries(since, until):
+        yield from _read_range(entry, since, until)
+
+
+def read_page(
+    since: datetime.datetime | None,
+    until: datetime.datetime | None,
+    offset: int,
+    limit: int,
+) -> tuple[list[dict], int]:
+    # One page of archived rows and the number of archived rows in the range.
+    # Months wholly in the range are counted from the manifest and only
+    # unpacked when the page falls in them, so only the page and the (at most
+    # two) months cut by since/until are read.
+    rows, total = [], 0
+    for entry in _entries(since, until):
+        if _covers(entry, since, until) and (
+            total + entry["count"] <= offset or len(rows) >= limit
+        ):
+            total += entry["count"]
+            continue
+
+        for row in _read_range(entry, since, until):
+            if total >= offset and len(rows) < limit:
+                rows.append(row)
+            total += 1
+    return rows, total
+
+
+def find(transaction_id: int) -> dict | None:
+    for entry in read_manifest().values():
+        if entry["count"] and entry["min_id"] <= transaction_id <= entry["max_id"]:
+            for row in _read_file(entry):
+                if row["id"] == transaction_id:
+                    return row
+    return None
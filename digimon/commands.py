@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+
+from . import config
+from . import migrations
+from . import models
+from . import partitions
+from . import rollups
+from . import scoring
+
+
+async def migrate(args):
+    version = await migrations.migrate()
+    print(f"schema migrated from version {version} to {migrations.SCHEMA_VERSION}")
+
+
+async def rebuild_rollups(args):
+    async with models.create_session() as session:
+        count = await rollups.rebuild(session)
+        await session.commit()
+
+    print(f"rollups rebuilt from {count} transactions")
+
+
+async def rescore_transactions(args):
+    async with models.create_session() as session:
+        count = await scoring.rescore(session)
+        await session.commit()
+
+    print(f"{count} transactions rescored")
+
+
+async def archive_transactions(args):
+    async with models.engine.begin() as connection:
+        await connection.run_sync(partitions.ensure_partitions)
+
+    async with models.create_session() as session:
+        entries = await partitions.archive_closed(session)
+
+    for entry in entries:
+        print(f"{entry['file']}: {entry['count']} transactions archived")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="digimon")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="bring the database schema to the current version"
+    )
+    migrate_parser.set_defaults(func=migrate)
+
+    rebuild_parser = subparsers.add_parser(
+        "rebuild-rollups", help="recompute sales rollups from the transaction ledger"
+    )
+    rebuild_parser.set_defaults(func=rebuild_rollups)
+
+    rescore_parser = subparsers.add_parser(
+        "rescore-transactions", help="recompute fraud scores over the whole ledger"
+    )
+    rescore_parser.set_defaults(func=rescore_transactions)
+
+    archive_parser = subparsers.add_parser(
+        "archive-transactions",
+        help="create upcoming partitions and archive months past the hot window",
+    )
+    archive_parser.set_defaults(func=archive_transactions)
+
+    return parser
+
+
+async def run(args):
+    try:
+        await args.func(args)
+    finally:
+        await models.close_session()
+
+
+def main():
+    args = get_parser().parse_args()
+
+    models.init_db(config.get_settings())
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,80 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class Settings(BaseSettings):
     SQLDB_URL: str
     SECRET_KEY: str = "secret"
+    # run migrations at worker start instead of only checking the version,
+    # for local development
+    AUTO_MIGRATE: bool = False
+
+    # worker processes of digimon.runner, 0 starts one per CPU
+    WORKERS: int = 0
+    # set by digimon.runner to the number of workers it forks, 0 for a single
+    # process (e.g. plain uvicorn)
+    RUNNER_WORKERS: int = 0
+    # connections to the database across all workers, each runner worker's
+    # pool gets a share and a single process all of it, unset keeps
+    # SQLAlchemy's default pool size per process
+    DB_CONNECTION_BUDGET: int | None = None
+    WORKER_SHUTDOWN_TIMEOUT_SECONDS: int = 30
+
+    # how long a worker trusts its cached token version of a user, i.e. the
+    # longest a revoked token (password change, role change) stays usable
+    TOKEN_VERSION_CACHE_SECONDS: float = 30
+    TOKEN_VERSION_CACHE_MAX_USERS: int = 100_000
 
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 5 * 60  # 5 minutes
     REFRESH_TOKEN_EXPIRE_MINUTES: int = 7 * 24 * 60  # 7 days
 
+    TRANSACTION_BATCHING: bool = False
+    TRANSACTION_BATCH_MAX_SIZE: int = 200
+    TRANSACTION_BATCH_MAX_DELAY_MS: float = 5.0
+
+    FRAUD_SCORING: bool = True
+    FRAUD_WINDOW_SIZE: int = 64
+    FRAUD_MIN_HISTORY: int = 5
+    FRAUD_AMOUNT_Z_LIMIT: float = 4.0
+    FRAUD_VELOCITY_SECONDS: float = 60
+    FRAUD_VELOCITY_LIMIT: int = 10
+    FRAUD_FANOUT_LIMIT: int = 8
+    FRAUD_MAX_WALLETS: int = 100_000
+    FRAUD_STATE_TTL_SECONDS: float = 300
+
+    ADMISSION_CONTROL: bool = True
+    # requests per second per user, or per client IP for anonymous requests;
+    # 0 disables rate limiting. Clients behind one NAT or load balancer share
+    # an IP, list the proxies in TRUSTED_PROXIES to key on X-Forwarded-For.
+    RATE_LIMIT_PER_SECOND: float = 0
+    RATE_LIMIT_BURST: int = 40
+    RATE_LIMIT_MAX_KEYS: int = 100_000
+    # addresses or networks of proxies whose X-Forwarded-For is believed
+    TRUSTED_PROXIES: list[str] = []
+    # concurrent requests per route class, see admission.route_class
+    CONCURRENCY_LIMITS: dict[str, int] = {"auth": 4, "read": 256, "write": 64}
+    CONCURRENCY_QUEUE_TIMEOUT_MS: float = 250
+    POOL_WAIT_SHED_THRESHOLD_MS: float = 100
+
+    LAST_LOGIN_FLUSH_INTERVAL_SECONDS: float = 5
+
+    # months kept in the hot transaction table, older ones get archived
+    TRANSACTION_HOT_MONTHS: int = 3
+    # partitions created ahead of time, archive-transactions has to run at
+    # least this often (monthly from cron) or inserts run out of partitions
+    TRANSACTION_PARTITIONS_AHEAD: int = 2
+    ARCHIVE_DIR: str = "archive"
+
+    # seconds before a request is cancelled with a 504, ROUTE_TIMEOUTS
+    # overrides it by path prefix (the longest match wins), 0 for no deadline
+    REQUEST_TIMEOUT_SECONDS: float = 10
+    ROUTE_TIMEOUTS: dict[str, float] = {
+        "/token": 5,
+        "/transactions/batch": 30,
+        "/debug": 0,
+    }
+
+    TRACING_ENABLED: bool = False
+    TRACE_EXPORT_PATH: str = "traces.jsonl"
+    PROFILE_MAX_SECONDS: int = 60
+    PROFILE_SAMPLE_INTERVAL_MS: float = 10
+
     model_config = SettingsConfigDict(
         env_file=".env", validate_assignment=True, extra="allow"
     )
@@ -0,0 +1,200 @@
+"""Per-request time budgets.
+
+The budget of a request (REQUEST_TIMEOUT_SECONDS, or the longest matching
+prefix in ROUTE_TIMEOUTS) becomes a deadline in a context variable. The
+request is cancelled, along with its in-flight query, when the budget runs
+out (504) or the client disconnects. On Postgres the connections of the app
+also carry the longest budget as their statement_timeout, set once when a
+connection is opened, as a server-side backstop for queries the
+cancellation does not reach.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import time
+
+from sqlalchemy import event, exc
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# Postgres "canceling statement due to statement timeout"
+QUERY_CANCELED = "57014"
+
+
+class RequestTiming:
+    __slots__ = ("started", "deadline", "db_seconds", "queries")
+
+    def __init__(self, budget: float | None):
+        self.started = time.monotonic()
+        self.deadline = self.started + budget if budget else None
+        self.db_seconds = 0.0
+        self.queries = 0
+
+    def remaining(self) -> float | None:
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def report(self) -> dict:
+        return dict(
+            budget_ms=(self.deadline - self.started) * 1000 if self.deadline else None,
+            elapsed_ms=(time.monotonic() - self.started) * 1000,
+            db_ms=self.db_seconds * 1000,
+            queries=self.queries,
+        )
+
+
+current_timing: contextvars.ContextVar[RequestTiming | None] = contextvars.ContextVar(
+    "current_timing", default=None
+)
+
+
+def remaining() -> float | None:
+    # seconds left of the current request's budget, None outside a request or
+    # without a deadline
+    timing = current_timing.get()
+    return timing.remaining() if timing else None
+
+
+def route_budget(settings: config.Settings, path: str) -> float:
+    prefixes = [prefix for prefix in settings.ROUTE_TIMEOUTS if path.startswith(prefix)]
+    if prefixes:
+        return settings.ROUTE_TIMEOUTS[max(prefixes, key=len)]
+    return settings.REQUEST_TIMEOUT_SECONDS
+
+
+def statement_timeout(settings: config.Settings) -> float | None:
+    # seconds, the longest budget any route has; routes without a deadline
+    # (debug) do not query for long
+    budgets = [settings.REQUEST_TIMEOUT_SECONDS, *settings.ROUTE_TIMEOUTS.values()]
+    return max(budgets) or None
+
+
+def instrument(engine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        context._deadline_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        timing = current_timing.get()
+        if timing is not None:
+            timing.db_seconds += time.perf_counter() - context._deadline_started
+            timing.queries += 1
+
+
+class DeadlineMiddleware:
+    """Runs every request as a task next to a watcher of its receive channel,
+    the task is cancelled on client disconnect or when its budget is spent.
+    Cancelling the task cancels an awaited asyncpg query on the server."""
+
+    def __init__(self, app, settings: config.Settings):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming(route_budget(self.settings, scope["path"]))
+        current_timing.set(timing)
+
+        response_started = response_complete = False
+
+        async def tracked_send(message):
+            nonlocal response_started, response_complete
+            if message["type"] == "http.response.start":
+                response_started = True
+            elif message["type"] == "http.response.body" and not message.get(
+                "more_body"
+            ):
+                response_complete = True
+            await send(message)
+
+        # the watcher owns receive() and hands the messages to the app
+        messages = asyncio.Queue()
+
+        async def watch():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        watcher = asyncio.create_task(watch())
+        task = asyncio.create_task(self.app(scope, messages.get, tracked_send))
+        try:
+            done, _ = await asyncio.wait(
+                {task, watcher},
+                timeout=timing.remaining(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            # the server reports a disconnect once the response is complete,
+            # the app may still be finishing up
+            if task not in done and response_complete:
+                done, _ = await asyncio.wait({task}, timeout=timing.remaining())
+
+            if task in done:
+                try:
+                    task.result()
+                except exc.DBAPIError as e:
+                    if getattr(e.orig, "sqlstate", None) != QUERY_CANCELED:
+                        raise
+                    await self.timed_out(scope, send, timing, response_started)
+                return
+
+            await self.cancel(task)
+            if watcher in done:
+                logger.info(
+                    "client disconnected, cancelled %s %s after %.0f ms",
+                    scope["method"],
+                    scope["path"],
+                    timing.report()["elapsed_ms"],
+                )
+                return
+
+            await self.timed_out(scope, send, timing, response_started)
+        finally:
+            await self.cancel(watcher)
+            if not task.done():
+                await self.cancel(task)
+
+    async def cancel(self, task: asyncio.Task):
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+
+    async def timed_out(
+        self, scope, send, timing: RequestTiming, response_started: bool
+    ):
+        report = timing.report()
+        logger.warning(
+            "deadline exceeded %s %s: %s", scope["method"], scope["path"], report
+        )
+        # a response already on the wire can only be cut short
+        if response_started:
+            return
+
+        body = json.dumps(dict(detail="Request timed out", timing=report)).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 504,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
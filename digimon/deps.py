@@ -1,9 +1,10 @@
 import jwt
 import typing
 
-from fastapi import Depends, HTTPException, status, Path, Query
+from fastapi import Depends, HTTPException, status, Path, Query, Header, Response
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import ValidationError
+from sqlmodel import select
 
 from . import models
 from . import config
@@ -14,10 +15,29 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 settings = config.get_settings()
 
 
-async def get_current_user(
+def get_token_subject(authorization: str | None) -> str | None:
+    # used to key rate limits before routing, invalid tokens count as anonymous
+    if not authorization:
+        return None
+
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[security.ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+
+    return payload.get("sub")
+
+
+async def get_token_claims(
     token: typing.Annotated[str, Depends(oauth2_scheme)],
     session: typing.Annotated[models.AsyncSession, Depends(models.get_session)],
-) -> models.User:
+) -> models.TokenClaims:
+    # decoded from the signed token, the database is only read when this
+    # worker's cached token version of the user has expired
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -26,20 +46,59 @@ async def get_current_user(
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[security.ALGORITHM])
 
-        user_id: int = payload.get("sub")
+        user_id = payload.get("sub")
 
         if user_id is None:
             raise credentials_exception
 
-    except jwt.JWTError as e:
+        claims = models.TokenClaims(
+            user_id=user_id,
+            role_mask=payload.get("rol", 0),
+            status=payload.get("sts", "active"),
+            token_version=payload.get("ver", 0),
+        )
+
+    except (jwt.PyJWTError, ValidationError) as e:
         print(e)
         raise credentials_exception
-    
-    user = await session.get(models.DBUser, user_id)
+
+    token_version = security.token_versions.get(claims.user_id)
+    if token_version is None:
+        result = await session.exec(
+            select(models.DBUser.token_version).where(
+                models.DBUser.id == claims.user_id
+            )
+        )
+        token_version = result.first()
+        if token_version is None:
+            raise credentials_exception
+        security.token_versions.set(claims.user_id, token_version)
+
+    if claims.token_version < token_version:
+        raise credentials_exception
+
+    return claims
+
+
+async def get_current_user(
+    claims: typing.Annotated[models.TokenClaims, Depends(get_token_claims)],
+    session: typing.Annotated[models.AsyncSession, Depends(models.get_session)],
+) -> models.User:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    user = await session.get(models.DBUser, claims.user_id)
 
     if user is None:
         raise credentials_exception
 
+    if claims.token_version < user.token_version:
+        security.revoke_tokens(user.id, user.token_version)
+        raise credentials_exception
+
     return user
 
 
@@ -51,28 +110,85 @@ async def get_current_active_user(
     return current_user
 
 
+async def get_current_active_claims(
+    claims: typing.Annotated[models.TokenClaims, Depends(get_token_claims)]
+) -> models.TokenClaims:
+    if claims.status != "active":
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return claims
+
+
 async def get_current_active_superuser(
-    current_user: typing.Annotated[models.User, Depends(get_current_user)],
-) -> models.User:
-    if "admin" not in current_user.roles:
+    claims: typing.Annotated[models.TokenClaims, Depends(get_current_active_claims)],
+) -> models.TokenClaims:
+    if "admin" not in claims.roles:
         raise HTTPException(
             status_code=400, detail="The user doesn't have enough privileges"
         )
-    return current_user
+    return claims
 
 
 class RoleChecker:
-    def __init__(self, *allowed_roles: list[str]):
+    def __init__(self, *allowed_roles: str):
         self.allowed_roles = allowed_roles
+        self.allowed_mask = models.encode_roles(allowed_roles)
 
     def __call__(
         self,
-        user: typing.Annotated[models.User, Depends(get_current_active_user)],
+        claims: typing.Annotated[
+            models.TokenClaims, Depends(get_current_active_claims)
+        ],
     ):
-        for role in user.roles:
-            if role in self.allowed_roles:
-                return 
-        
-        # logger.debug(f"User with role {user.roles} not in {self.allowed_roles}")
+        if claims.role_mask & self.allowed_mask:
+            return
+
+        # logger.debug(f"User with role {claims.roles} not in {self.allowed_roles}")
         raise HTTPException(status_code=403, detail="Role not permitted")
-    
\ No newline at end of file
+
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def get_if_match(
+    if_match: typing.Annotated[str | None, Header()] = None,
+) -> int | None:
+    # the resource version from an If-Match ETag, None for absent or "*"
+    if if_match is None or if_match.strip() == "*":
+        return None
+
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Precondition failed",
+        )
+
+
+async def update_or_fail(
+    session: models.AsyncSession,
+    model,
+    id: int,
+    values: dict,
+    version: int | None,
+    response: Response,
+    *where,
+    detail: str = "Not found",
+):
+    db_object = await models.update_versioned(
+        session, model, id, values, version, *where
+    )
+    if db_object is None:
+        # only on failure: tell a missing row from a stale version
+        if await session.get(model, id) is None:
+            raise HTTPException(status_code=404, detail=detail)
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Precondition failed",
+        )
+
+    await session.commit()
+    response.headers["ETag"] = etag(db_object.version)
+
+    return db_object
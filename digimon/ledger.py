@@ -0,0 +1,273 @@
+import asyncio
+import collections
+import datetime
+import logging
+import math
+
+from sqlalchemy import case, insert, update
+from sqlmodel import select
+
+from . import config
+from . import models
+from . import rollups
+
+logger = logging.getLogger(__name__)
+
+settings = config.get_settings()
+
+
+async def insert_transactions(
+    session: models.AsyncSession, rows: list[dict]
+) -> list[int]:
+    # One multi-row INSERT ... RETURNING id, ids come back in the order of rows
+    if not rows:
+        return []
+
+    # stamped here so the caller's dicts, the ledger and the rollups agree
+    now = datetime.datetime.now()
+    for row in rows:
+        row.setdefault("created_at", now)
+
+    if settings.FRAUD_SCORING:
+        # only when enabled, numpy is the heaviest import of the app (workers
+        # load it at startup)
+        from . import scoring
+
+        await scoring.scorer.score(session, rows)
+
+    result = await session.exec(
+        insert(models.DBTransaction).returning(
+            models.DBTransaction.id, sort_by_parameter_order=True
+        ),
+        params=rows,
+    )
+    ids = list(result.scalars())
+
+    await rollups.apply(session, rows)
+
+    return ids
+
+
+async def apply_batch(
+    session: models.AsyncSession, legs: list[dict], best_effort: bool = False
+) -> tuple[list[models.Transaction], list[models.RejectedTransaction]]:
+    outcomes = await settle(session, legs, best_effort)
+
+    transactions, rejected = [], []
+    for leg, outcome in zip(legs, outcomes):
+        if isinstance(outcome, int):
+            transactions.append(models.Transaction(id=outcome, **leg))
+        elif outcome is not None:
+            rejected.append(models.RejectedTransaction(**leg, reason=outcome))
+    return transactions, rejected
+
+
+async def settle(
+    session: models.AsyncSession, legs: list[dict], best_effort: bool = False
+) -> list[int | str | None]:
+    # Balances of every wallet involved are read and locked with one SELECT,
+    # funds are checked in memory, then all balance changes are applied with a
+    # single set-based UPDATE and the legs recorded with one multi-row INSERT.
+    # The caller owns the commit.
+    #
+    # Per leg its transaction id, the reason it was rejected, or None for the
+    # valid legs of an all-or-nothing batch that was rejected as a whole.
+    owners = {leg["sender"] for leg in legs} | {leg["receiver"] for leg in legs}
+    result = await session.exec(
+        select(models.DBWallet.owner, models.DBWallet.balance)
+        .where(models.DBWallet.owner.in_(owners))
+        # a fixed lock order, concurrent batches over the same wallets queue
+        # up instead of deadlocking
+        .order_by(models.DBWallet.id)
+        .with_for_update()
+    )
+    balances = {owner: balance for owner, balance in result.all()}
+
+    outcomes: list[int | str | None] = [None] * len(legs)
+    accepted = []
+    for index, leg in enumerate(legs):
+        # NaN compares false either way, it would poison the balances
+        if not 0 < leg["amount"] < math.inf:
+            outcomes[index] = "Amount must be positive and finite"
+        elif leg["sender"] == leg["receiver"]:
+            outcomes[index] = "Sender and receiver are the same wallet"
+        elif leg["sender"] not in balances:
+            outcomes[index] = "Sender wallet not found"
+        elif leg["receiver"] not in balances:
+            outcomes[index] = "Receiver wallet not found"
+        else:
+            accepted.append(index)
+
+    if best_effort:
+        # legs are taken in order against running balances, so a payout may be
+        # funded by a credit earlier in the same batch
+        running = dict(balances)
+        funded = []
+        for index in accepted:
+            leg = legs[index]
+            if running[leg["sender"]] < leg["amount"]:
+                outcomes[index] = "Insufficient funds"
+                continue
+            running[leg["sender"]] -= leg["amount"]
+            running[leg["receiver"]] += leg["amount"]
+            funded.append(index)
+        accepted = funded
+    elif len(accepted) == len(legs):
+        # all-or-nothing only needs every wallet to stay funded after netting
+        deltas = net_deltas([legs[index] for index in accepted])
+        for index in accepted:
+            sender = legs[index]["sender"]
+            if balances[sender] + deltas[sender] < 0:
+                outcomes[index] = "Insufficient funds"
+
+    if not best_effort and any(outcomes):
+        return outcomes
+
+    accepted_legs = [legs[index] for index in accepted]
+    deltas = {
+        owner: delta for owner, delta in net_deltas(accepted_legs).items() if delta
+    }
+    if deltas:
+        await session.exec(
+            update(models.DBWallet)
+            .where(models.DBWallet.owner.in_(deltas))
+            .values(
+                balance=models.DBWallet.balance
+                + case(deltas, value=models.DBWallet.owner, else_=0),
+                version=models.DBWallet.version + 1,
+            )
+        )
+
+    ids = await insert_transactions(session, accepted_legs)
+    for index, transaction_id in zip(accepted, ids):
+        outcomes[index] = transaction_id
+    return outcomes
+
+
+def net_deltas(legs: list[dict]) -> dict[str, float]:
+    # opposing flows between the same wallets cancel out here
+    deltas = collections.defaultdict(float)
+    for leg in legs:
+        deltas[leg["sender"]] -= leg["amount"]
+        deltas[leg["receiver"]] += leg["amount"]
+    return deltas
+
+
+class TransactionRejected(Exception):
+    pass
+
+
+class TransactionBatcher:
+    """Group-commit writer: queued transactions are flushed in micro-batches,
+    settled together (best effort, see settle) with one commit per batch
+    instead of per payment. A rejected transaction fails only its own
+    submit() with TransactionRejected."""
+
+    def __init__(self, max_size: int, max_delay: float):
+        self.max_size = max_size
+        self.max_delay = max_delay
+
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None
+
+    async def start(self):
+        if self.running:
+            return
+
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+
+        # sentinel: the worker flushes what is queued before it and exits
+        await self._queue.put(None)
+        await self._worker
+        self._worker = None
+
+    async def submit(self, data: dict) -> int:
+        # each transfer keeps its own time, rows flushed together are not a
+        # payout batch to the scorer
+        data.setdefault("created_at", datetime.datetime.now())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((data, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            entry = await self._queue.get()
+            if entry is None:
+                break
+
+            batch = [entry]
+            deadline = loop.time() + self.max_delay
+
+            while len(batch) < self.max_size:
+                try:
+                    entry = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple[dict, asyncio.Future]]):
+        try:
+            outcomes = await self._insert([data for data, _ in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                # one bad row must not fail the whole batch, the rows are
+                # retried one by one so only its caller gets the error
+                logger.warning(
+                    "flush of %d transactions failed, retrying one by one",
+                    len(batch),
+                    exc_info=True,
+                )
+                for entry in batch:
+                    await self._flush([entry])
+                return
+
+            logger.exception("transaction insert failed")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        logger.debug("flushed %d transactions", len(batch))
+        for (_, future), outcome in zip(batch, outcomes):
+            if future.done():
+                continue
+            if isinstance(outcome, int):
+                future.set_result(outcome)
+            else:
+                future.set_exception(TransactionRejected(outcome))
+
+    async def _insert(self, rows: list[dict]) -> list[int | str | None]:
+        async with models.create_session() as session:
+            outcomes = await settle(session, rows, best_effort=True)
+            await session.commit()
+        return outcomes
+
+
+transaction_batcher = TransactionBatcher(
+    max_size=settings.TRANSACTION_BATCH_MAX_SIZE,
+    max_delay=settings.TRANSACTION_BATCH_MAX_DELAY_MS / 1000,
+)
@@ -0,0 +1,80 @@
+import asyncio
+import datetime
+import logging
+
+from sqlalchemy import case, update
+
+from . import config
+from . import models
+
+logger = logging.getLogger(__name__)
+
+settings = config.get_settings()
+
+
+class LastLoginBuffer:
+    """Write-behind buffer for users.last_login_date: logins are recorded in
+    memory and written every `interval` seconds as one UPDATE, and on stop."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+
+        self._pending: dict[int, datetime.datetime] = {}
+        self._stopping: asyncio.Event | None = None
+        self._worker: asyncio.Task | None = None
+
+    def record(self, user_id: int, login_date: datetime.datetime):
+        previous = self._pending.get(user_id)
+        if previous is None or previous < login_date:
+            self._pending[user_id] = login_date
+
+    async def start(self):
+        if self._worker is None:
+            self._stopping = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # not cancelled, so a flush in progress is never lost half way
+        if self._worker is not None:
+            self._stopping.set()
+            await self._worker
+            self._worker = None
+
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        try:
+            async with models.create_session() as session:
+                await session.exec(
+                    update(models.DBUser)
+                    .where(models.DBUser.id.in_(pending))
+                    .values(
+                        last_login_date=case(pending, value=models.DBUser.id)
+                    )
+                )
+                await session.commit()
+        except Exception:
+            logger.exception("flush of %d login dates failed", len(pending))
+            # keep them for the next flush, unless a newer login came in since
+            for user_id, login_date in pending.items():
+                self.record(user_id, login_date)
+            return
+
+        logger.debug("flushed %d login dates", len(pending))
+
+
+last_login_buffer = LastLoginBuffer(
+    interval=settings.LAST_LOGIN_FLUSH_INTERVAL_SECONDS
+)
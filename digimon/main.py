@@ -1,20 +1,112 @@
-from fastapi import FastAPI
+import time
+
+started = time.perf_counter()
+
+import logging
+import math
+
+from fastapi import FastAPI, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
 
 from . import config
 from . import routers
 from . import models
+from . import ledger
+from . import admission
+from . import logins
+from . import migrations
+from . import tracing
+from . import deadlines
+
+logger = logging.getLogger(__name__)
+
+imported = time.perf_counter()
+# set by digimon.runner in each worker right after the fork, the master
+# imported and built the app before it
+forked = None
+
+
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    # NaN and infinity are rejected as input, echoed back as they are they
+    # would not serialize to JSON
+    errors = [
+        dict(error, input=str(error["input"]))
+        if isinstance(error.get("input"), float) and not math.isfinite(error["input"])
+        else error
+        for error in exc.errors()
+    ]
+    return JSONResponse(status_code=422, content=jsonable_encoder({"detail": errors}))
 
 
 def create_app():
+    create_started = time.perf_counter()
     settings = config.get_settings()
-    app = FastAPI()
+    if settings.TRACING_ENABLED:
+        app = FastAPI(default_response_class=tracing.TracedJSONResponse)
+    else:
+        app = FastAPI()
 
-    models.init_db(settings)
+    models.init_db(settings, statement_timeout=deadlines.statement_timeout(settings))
+    if settings.TRACING_ENABLED:
+        tracing.instrument_engine(models.engine)
 
     routers.init_router(app)
+    app.add_exception_handler(RequestValidationError, validation_exception_handler)
+
+    if settings.ADMISSION_CONTROL:
+        app.add_middleware(admission.AdmissionMiddleware, settings=settings)
+    # outside admission control, so time queued for a slot counts against the
+    # request's budget
+    app.add_middleware(deadlines.DeadlineMiddleware, settings=settings)
+    # added last to be outermost, shed requests get traced too
+    if settings.TRACING_ENABLED:
+        app.add_middleware(tracing.TracingMiddleware)
+
+    created = time.perf_counter()
 
     @app.on_event("startup")
     async def startup():
-        await models.create_all()
+        startup_started = time.perf_counter()
+
+        # migrations run out-of-band (python -m digimon.commands migrate),
+        # a worker only checks the schema version
+        if settings.AUTO_MIGRATE:
+            await migrations.migrate()
+        else:
+            await migrations.check()
+        schema_checked = time.perf_counter()
+
+        if settings.FRAUD_SCORING:
+            # numpy is the heaviest import of the app, loaded before the first
+            # request instead of by the first transfer
+            from . import scoring  # noqa: F401
+        preloaded = time.perf_counter()
+
+        await logins.last_login_buffer.start()
+
+        if settings.TRANSACTION_BATCHING:
+            await ledger.transaction_batcher.start()
+
+        ready = time.perf_counter()
+        app.state.startup_report = dict(
+            import_ms=(imported - started) * 1000,
+            create_app_ms=(created - create_started) * 1000,
+            schema_check_ms=(schema_checked - startup_started) * 1000,
+            preload_ms=(preloaded - schema_checked) * 1000,
+            startup_ms=(ready - startup_started) * 1000,
+            # a forked worker's own time, the import is shared with the master
+            total_ms=(ready - (started if forked is None else forked)) * 1000,
+        )
+        logger.info(
+            "startup: %s",
+            ", ".join(f"{k} {v:.1f}" for k, v in app.state.startup_report.items()),
+        )
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        await ledger.transaction_batcher.stop()
+        await logins.last_login_buffer.stop()
 
-    return app
\ No newline at end of file
+    return app
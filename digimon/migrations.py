@@ -0,0 +1,263 @@
+import datetime
+import logging
+
+from sqlalchemy import exc, false, func, insert, inspect, text
+from sqlalchemy.schema import CreateIndex
+from sqlmodel import select
+
+from . import models
+from . import partitions
+
+logger = logging.getLogger(__name__)
+
+# bump with every schema change and add the step upgrading to it in MIGRATIONS
+SCHEMA_VERSION = 4
+# Steps only expand the schema, whatever they replace is dropped a release
+# later, so workers of this release keep running against the next release's
+# schema while a rolling deploy (or the runner's reap) replaces them.
+MAX_COMPATIBLE_SCHEMA_VERSION = SCHEMA_VERSION + 1
+
+
+def _create_index(connection, table, name: str):
+    # IF NOT EXISTS, the baseline recreates the ledger with all of its indexes
+    [index] = [index for index in table.indexes if index.name == name]
+    connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _add_column(connection, table, name: str, default: str | None):
+    # with the type, nullability and foreign key of the model's column,
+    # existing rows get `default` (SQL)
+    column = table.c[name]
+    ddl = (
+        f'ALTER TABLE "{table.name}" ADD COLUMN "{name}" '
+        f"{column.type.compile(dialect=connection.dialect)}"
+    )
+    if default is not None:
+        ddl += f" DEFAULT {default}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    for foreign_key in column.foreign_keys:
+        ddl += (
+            f' REFERENCES "{foreign_key.column.table.name}" ({foreign_key.column.name})'
+        )
+    connection.execute(text(ddl))
+
+
+def baseline(connection):
+    # Databases created by create_all before schema versioning existed: adds
+    # the columns introduced since, creates the new tables and on Postgres
+    # moves the ledger into a partitioned table. Rollups and fraud scores of
+    # the existing ledger need 'rebuild-rollups' and 'rescore-transactions'.
+    #
+    # SQLite only adds columns with a constant default, so the creation time
+    # of existing transactions (unknown anyway) is the time of the migration.
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+    columns = {
+        models.DBItem: dict(version="1"),
+        models.DBMerchant: dict(version="1"),
+        models.DBWallet: dict(version="1"),
+        models.DBUser: dict(
+            version="1",
+            role_mask=str(models.encode_roles(["user"])),
+            status="'active'",
+            token_version="0",
+        ),
+        models.DBTransaction: dict(
+            merchant_id=None,
+            created_at=f"'{now}'",
+            risk_score="0",
+            flagged=str(false().compile(dialect=connection.dialect)),
+        ),
+    }
+    for model, defaults in columns.items():
+        table = model.__table__
+        inspector = inspect(connection)
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for name, default in defaults.items():
+            if name not in existing:
+                _add_column(connection, table, name, default)
+
+    if connection.dialect.name == "postgresql":
+        _partition_ledger(connection)
+    else:
+        partitions.create_tables(connection)
+        _create_index(
+            connection, models.DBTransaction.__table__, "ix_transaction_created_at"
+        )
+
+    logger.warning(
+        "pre-versioning schema upgraded, run rebuild-rollups and rescore-transactions"
+    )
+
+
+def _partition_ledger(connection):
+    # the plain transaction table is renamed away, its rows copied into the
+    # partitioned one in partitions of their months
+    table = partitions.TABLE
+    connection.execute(text(f'ALTER TABLE "{table}" RENAME TO "{table}_baseline"'))
+    partitions.create_tables(connection)
+
+    months = connection.execute(
+        text(
+            "SELECT DISTINCT date_trunc('month', created_at) "
+            f'FROM "{table}_baseline"'
+        )
+    ).scalars()
+    for month in months:
+        partitions.create_partition(connection, month)
+
+    names = ", ".join(
+        f'"{column.name}"' for column in models.DBTransaction.__table__.columns
+    )
+    connection.execute(
+        text(f'INSERT INTO "{table}" ({names}) SELECT {names} FROM "{table}_baseline"')
+    )
+    connection.execute(text(f'DROP TABLE "{table}_baseline"'))
+    # the partitioned table has a sequence of its own
+    connection.execute(
+        text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+            f'COALESCE(MAX(id), 0) + 1, false) FROM "{table}"'
+        )
+    )
+
+
+def unique_wallet_owner(connection):
+    # fails on duplicate owners, those have to be merged by hand first
+    _create_index(connection, models.DBWallet.__table__, "ix_wallet_owner")
+
+
+def transaction_sender_index(connection):
+    _create_index(
+        connection,
+        models.DBTransaction.__table__,
+        "ix_transaction_sender_created_at",
+    )
+
+
+def cascade_rollup_deletes(connection):
+    # SQLite does not enforce foreign keys unless asked to, nor can it alter
+    # them; the rollup tables there keep the constraints they were created with
+    if connection.dialect.name != "postgresql":
+        return
+
+    for model in (models.DBMerchantRollup, models.DBWalletRollup):
+        table = model.__table__
+        [foreign_key] = table.foreign_keys
+        [existing] = [
+            constraint
+            for constraint in inspect(connection).get_foreign_keys(table.name)
+            if constraint["constrained_columns"] == [foreign_key.parent.name]
+        ]
+        connection.execute(
+            text(
+                f'ALTER TABLE "{table.name}" '
+                f'DROP CONSTRAINT "{existing["name"]}", '
+                f'ADD FOREIGN KEY ("{foreign_key.parent.name}") '
+                f'REFERENCES "{foreign_key.column.table.name}" '
+                f'("{foreign_key.column.name}") ON DELETE CASCADE'
+            )
+        )
+
+
+# version -> function(sync connection) upgrading a database from version - 1
+MIGRATIONS = {
+    1: baseline,
+    2: unique_wallet_owner,
+    3: transaction_sender_index,
+    4: cascade_rollup_deletes,
+}
+
+
+class SchemaVersionError(Exception):
+    pass
+
+
+def _read_version(connection) -> int | None:
+    # None for an empty database, 0 for one from before schema versioning
+    inspector = inspect(connection)
+    if inspector.has_table(models.DBSchemaVersion.__tablename__):
+        return connection.execute(
+            select(func.max(models.DBSchemaVersion.version))
+        ).scalar()
+    if inspector.has_table(models.DBUser.__tablename__):
+        return 0
+    return None
+
+
+async def check():
+    # one query at worker start instead of create_all's reflection of every table
+    try:
+        async with models.engine.connect() as connection:
+            result = await connection.execute(
+                select(func.max(models.DBSchemaVersion.version))
+            )
+            version = result.scalar()
+    except exc.DBAPIError:
+        version = None
+
+    compatible = SCHEMA_VERSION <= (version or 0) <= MAX_COMPATIBLE_SCHEMA_VERSION
+    if not compatible:
+        raise SchemaVersionError(
+            f"database schema is at version {version}, expected {SCHEMA_VERSION}"
+            f"..{MAX_COMPATIBLE_SCHEMA_VERSION}, "
+            "run 'python -m digimon.commands migrate' or deploy a newer release"
+        )
+    if version != SCHEMA_VERSION:
+        logger.info(
+            "database schema is at version %d, ahead of this release's %d",
+            version,
+            SCHEMA_VERSION,
+        )
+
+    # There is no default partition, so a missed archive-transactions run would
+    # fail every insert once the month turns. Caught up here, loudly.
+    async with models.engine.connect() as connection:
+        missing = await connection.run_sync(partitions.missing_partitions)
+    if not missing:
+        return
+
+    logger.warning(
+        "creating missing transaction partitions %s, is archive-transactions "
+        "scheduled?",
+        ", ".join(partitions.partition_name(month) for month in missing),
+    )
+    try:
+        async with models.engine.begin() as connection:
+            for month in missing:
+                await connection.run_sync(partitions.create_partition, month)
+    except exc.DBAPIError:
+        # workers starting together race to create them, fine if one won
+        async with models.engine.connect() as connection:
+            if await connection.run_sync(partitions.missing_partitions):
+                raise
+
+
+async def migrate() -> int | None:
+    # Run once out-of-band before workers start. An empty database gets the
+    # current schema directly, any other one the steps after its version, from
+    # the baseline (1) for one without a schema version. Returns the version
+    # found before migrating.
+    async with models.engine.begin() as connection:
+        version = await connection.run_sync(_read_version)
+
+        if version is None:
+            await connection.run_sync(partitions.create_tables)
+        else:
+            for step in range(version + 1, SCHEMA_VERSION + 1):
+                logger.info("migrating schema to version %d", step)
+                await connection.run_sync(MIGRATIONS[step])
+
+        await connection.run_sync(partitions.ensure_partitions)
+
+        # a newer release may have migrated already, its version stays
+        if version is None or version < SCHEMA_VERSION:
+            await connection.execute(
+                insert(models.DBSchemaVersion).values(
+                    version=SCHEMA_VERSION, applied_date=datetime.datetime.now()
+                )
+            )
+
+    return version
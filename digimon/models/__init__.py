@@ -1,36 +1,65 @@
 from typing import AsyncIterator
 
 
-from sqlmodel import Field, SQLModel, create_engine, Session, select
+from sqlmodel import SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import make_url, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+from .. import deadlines
+from .. import pooling
 
-from . import items
-from . import merchants
-from . import users
 
+# All models are imported eagerly: the metadata has to know every table for
+# the schema check and create_all, and relationships resolve across modules.
 from .items import *
 from .merchants import *
 from .users import *
+from .transactions import *
+from .wallets import *
+from .rollups import *
+from .schema import *
 
 
 connect_args = {}
 
 engine = None
+async_session = None
 
 
-def init_db(settings):
-    global engine
+def init_db(settings, statement_timeout: float | None = None):
+    # statement_timeout (seconds) applies to every query on Postgres with
+    # asyncpg, sent along when a connection is opened
+    global engine, async_session
+
+    engine_options = {}
+    engine_connect_args = dict(connect_args)
+
+    # queue pools get their checkout wait measured for admission control,
+    # static pools (in-memory SQLite) never wait
+    url = make_url(settings.SQLDB_URL)
+    if issubclass(url.get_dialect().get_pool_class(url), AsyncAdaptedQueuePool):
+        engine_options["poolclass"] = pooling.MonitoredPool
+        engine_options.update(pooling.pool_options(settings))
+
+    if statement_timeout and url.get_driver_name() == "asyncpg":
+        engine_connect_args["server_settings"] = dict(
+            statement_timeout=str(int(statement_timeout * 1000))
+        )
 
     engine = create_async_engine(
         settings.SQLDB_URL,
         echo=True,
         future=True,
-        connect_args=connect_args,
+        connect_args=engine_connect_args,
+        **engine_options,
+    )
+    async_session = async_sessionmaker(
+        engine, class_=AsyncSession, expire_on_commit=False
     )
+    deadlines.instrument(engine)
 
 
 async def recreate_table():
@@ -39,9 +68,12 @@ async def recreate_table():
         await conn.run_sync(SQLModel.metadata.create_all)
 
 
+def create_session() -> AsyncSession:
+    return async_session()
+
+
 async def get_session() -> AsyncIterator[AsyncSession]:
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-    async with async_session() as session:
+    async with create_session() as session:
         yield session
 
 async def create_all():
@@ -49,6 +81,24 @@ async def create_all():
         await conn.run_sync(SQLModel.metadata.create_all)
 
 
+async def update_versioned(
+    session: AsyncSession, model, id: int, values: dict, version: int | None, *where
+):
+    # UPDATE ... WHERE id = :id [AND version = :version] RETURNING *, a single
+    # round trip; None when no row matched
+    stmt = (
+        update(model)
+        .where(model.id == id, *where)
+        .values(**values, version=model.version + 1)
+        .returning(model)
+    )
+    if version is not None:
+        stmt = stmt.where(model.version == version)
+
+    result = await session.exec(stmt)
+    return result.scalar_one_or_none()
+
+
 async def close_session():
     global engine
     if engine is None:
@@ -35,6 +35,7 @@ class Item(BaseItem):
 class DBItem(SQLModel, BaseItem, table=True):
     __tablename__ = "items"
     id: Optional[int] = Field(default=None, primary_key=True)
+    version: int = Field(default=1)
     merchant_id: int = Field(default=None, foreign_key="merchants.id")
     merchant: Optional[merchants.DBMerchant] = Relationship()
 
@@ -30,6 +30,7 @@ class Merchant(BaseMerchant):
 class DBMerchant(SQLModel, BaseMerchant, table=True):
     __tablename__ = "merchants"
     id: Optional[int] = Field(default=None, primary_key=True)
+    version: int = Field(default=1)
 
     user_id: int = Field(default=None, foreign_key="users.id")
     user: Optional[users.DBUser] = Relationship()
@@ -0,0 +1,63 @@
+import datetime
+from typing import List, Literal
+
+from pydantic import BaseModel, ConfigDict
+from sqlmodel import Field, SQLModel
+
+
+Granularity = Literal["hour", "day"]
+
+
+class RollupMetrics(SQLModel):
+    count: int = 0
+    total: float = 0
+    min_amount: float = 0
+    max_amount: float = 0
+
+
+class DBMerchantRollup(RollupMetrics, table=True):
+    __tablename__ = "merchant_rollups"
+    # derived data, goes with the merchant
+    merchant_id: int = Field(
+        primary_key=True, foreign_key="merchants.id", ondelete="CASCADE"
+    )
+    granularity: str = Field(primary_key=True)
+    bucket: datetime.datetime = Field(primary_key=True)
+
+
+class DBWalletRollup(RollupMetrics, table=True):
+    __tablename__ = "wallet_rollups"
+    # derived data, goes with the wallet
+    wallet_id: int = Field(
+        primary_key=True, foreign_key="wallet.id", ondelete="CASCADE"
+    )
+    direction: str = Field(primary_key=True)
+    granularity: str = Field(primary_key=True)
+    bucket: datetime.datetime = Field(primary_key=True)
+
+
+class StatsBucket(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    bucket: datetime.datetime
+    count: int
+    total: float
+    min_amount: float
+    max_amount: float
+
+
+class MerchantStats(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    merchant_id: int
+    granularity: Granularity
+    buckets: List[StatsBucket]
+
+
+class WalletStats(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    wallet_id: int
+    granularity: Granularity
+    incoming: List[StatsBucket]
+    outgoing: List[StatsBucket]
@@ -0,0 +1,9 @@
+import datetime
+
+from sqlmodel import Field, SQLModel
+
+
+class DBSchemaVersion(SQLModel, table=True):
+    __tablename__ = "schema_version"
+    version: int = Field(primary_key=True)
+    applied_date: datetime.datetime = Field(default_factory=datetime.datetime.now)
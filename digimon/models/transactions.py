@@ -1,6 +1,8 @@
-from typing import Optional, List
-from pydantic import BaseModel, ConfigDict
+import datetime
+from typing import Optional, List, Literal
+from pydantic import BaseModel, ConfigDict, confloat, conlist
 from sqlmodel import Field, SQLModel, create_engine, Session, select
+from sqlalchemy import Index
 
 # Import โมดูลที่เกี่ยวข้องภายในโปรเจกต์
 from . import items, merchants, wallets
@@ -11,26 +13,61 @@ class BaseTransaction(BaseModel):
     sender: str
     receiver: str
     amount: float
+    merchant_id: Optional[int] = None
+
+# จำนวนเงินที่รับจากผู้ใช้ ต้องเป็นบวกและไม่ใช่ NaN/inf
+PositiveAmount = confloat(gt=0, allow_inf_nan=False)
 
 # Model สำหรับสร้าง Transaction ใหม่
 class CreatedTransaction(BaseTransaction):
-    pass
+    amount: PositiveAmount
 
 # Model สำหรับอัปเดตข้อมูล Transaction
 class UpdatedTransaction(BaseTransaction):
-    pass
+    amount: PositiveAmount
 
 # Model สำหรับข้อมูล Transaction พร้อม ID
 class Transaction(BaseTransaction):
     id: int
+    created_at: Optional[datetime.datetime] = None
+    risk_score: float = 0
+    flagged: bool = False
+
+# Model สำหรับรายการที่ถูกปฏิเสธใน batch
+class RejectedTransaction(BaseTransaction):
+    reason: str
+
+# จำนวนรายการสูงสุดต่อ batch
+BATCH_MAX_SIZE = 5000
+
+# Model สำหรับสร้าง Transaction หลายรายการในครั้งเดียว
+class BatchTransaction(BaseModel):
+    transactions: conlist(CreatedTransaction, min_length=1, max_length=BATCH_MAX_SIZE)
+    mode: Literal["all_or_nothing", "best_effort"] = "all_or_nothing"
+
+# Model สำหรับผลลัพธ์ของ batch
+class BatchTransactionResult(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    transactions: List[Transaction]
+    rejected: List[RejectedTransaction]
 
 # Model สำหรับตารางในฐานข้อมูล
 class DBTransaction(SQLModel, table=True):
     __tablename__ = "transaction"
+    # history of a sender, read by fraud scoring and walked by rescoring
+    __table_args__ = (
+        Index("ix_transaction_sender_created_at", "sender", "created_at", "id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     sender: str
     receiver: str
     amount: float
+    merchant_id: Optional[int] = Field(default=None, foreign_key="merchants.id")
+    created_at: datetime.datetime = Field(
+        default_factory=datetime.datetime.now, index=True
+    )
+    risk_score: float = 0
+    flagged: bool = False
 
 # Model สำหรับรายการ Transaction พร้อม pagination
 class TransactionList(BaseModel):
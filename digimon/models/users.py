@@ -8,6 +8,19 @@ from sqlmodel import SQLModel, Field
 import bcrypt
 
 
+# bit positions of the roles in the role_mask column and the "rol" token claim,
+# append only
+ROLES = ("user", "merchant", "admin")
+
+
+def encode_roles(roles) -> int:
+    return sum(1 << ROLES.index(role) for role in set(roles) if role in ROLES)
+
+
+def decode_roles(role_mask: int) -> List[str]:
+    return [role for bit, role in enumerate(ROLES) if role_mask & (1 << bit)]
+
+
 class BaseUser(BaseModel):
     model_config = ConfigDict(from_attributes=True, populate_by_name=True)
     email: str = pydantic.Field(json_schema_extra=dict(example="admin@email.local"))
@@ -24,6 +37,8 @@ class User(BaseUser):
     register_date: Optional[datetime.datetime] = pydantic.Field(
         json_schema_extra=dict(example="2023-01-01T00:00:00.000000"), default=None
     )
+    roles: List[str] = []
+    status: str = "active"
 
 
 class ReferenceUser(BaseModel):
@@ -72,6 +87,17 @@ class Token(BaseModel):
     user_id: int
 
 
+class TokenClaims(BaseModel):
+    user_id: int
+    role_mask: int = 0
+    status: str = "active"
+    token_version: int = 0
+
+    @property
+    def roles(self) -> List[str]:
+        return decode_roles(self.role_mask)
+
+
 class ChangedPasswordUser(BaseModel):
     current_password: str
     new_password: str
@@ -80,6 +106,7 @@ class ChangedPasswordUser(BaseModel):
 class DBUser(SQLModel, BaseUser, table=True):
     __tablename__ = "users"
     id: Optional[int] = Field(default=None, primary_key=True)
+    version: int = Field(default=1)
 
     password: str
 
@@ -87,6 +114,16 @@ class DBUser(SQLModel, BaseUser, table=True):
     updated_date: datetime.datetime = Field(default_factory=datetime.datetime.now)
     last_login_date: Optional[datetime.datetime] = Field(default=None)
 
+    role_mask: int = Field(default=encode_roles(["user"]))
+    status: str = Field(default="active")
+    # bumped on role, status or password changes, tokens carrying an older
+    # version are rejected
+    token_version: int = Field(default=0)
+
+    @property
+    def roles(self) -> List[str]:
+        return decode_roles(self.role_mask)
+
     async def has_roles(self, roles):
         return any(role in self.roles for role in roles)
 
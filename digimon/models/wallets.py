@@ -27,7 +27,9 @@ class Wallet(BaseWallet):
 class DBWallet(SQLModel, table=True):
     __tablename__ = "wallet"
     id: Optional[int] = Field(default=None, primary_key=True)
-    owner: str
+    version: int = Field(default=1)
+    # wallets are addressed by owner in transactions
+    owner: str = Field(index=True, unique=True)
     balance: float
 
 # Model สำหรับรายการ Wallet พร้อม pagination
@@ -0,0 +1,233 @@
+import datetime
+import logging
+
+from sqlalchemy import Index, MetaData, Table, delete, func, inspect, text
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlmodel import SQLModel, select
+
+from . import archive
+from . import config
+from . import models
+
+logger = logging.getLogger(__name__)
+
+settings = config.get_settings()
+
+TABLE = models.DBTransaction.__tablename__
+
+ARCHIVE_CHUNK_SIZE = 1000
+
+
+def month_start(timestamp: datetime.datetime) -> datetime.datetime:
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime.datetime, months: int) -> datetime.datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime.datetime) -> str:
+    return f"{TABLE}_y{month.year}m{month.month:02d}"
+
+
+def partitioned_table() -> Table:
+    # Postgres requires the partition key in the primary key, so the
+    # partitioned DDL uses (id, created_at). The ORM model keeps id alone,
+    # ids stay unique through the shared sequence.
+    columns = []
+    for column in models.DBTransaction.__table__.columns:
+        column = column._copy()
+        column.primary_key = column.name in ("id", "created_at")
+        if column.name == "id":
+            column.autoincrement = True
+        columns.append(column)
+
+    table = Table(
+        TABLE, MetaData(), *columns, postgresql_partition_by="RANGE (created_at)"
+    )
+    # composite indexes belong to the model's table, not to a column
+    for index in models.DBTransaction.__table__.indexes:
+        if len(index.columns) > 1:
+            Index(index.name, *(table.c[column.name] for column in index.columns))
+    return table
+
+
+def create_tables(connection):
+    # SQLite has no partitioning, there the ledger stays one table indexed on
+    # created_at and archival works on month ranges of it
+    if connection.dialect.name != "postgresql":
+        SQLModel.metadata.create_all(connection)
+        return
+
+    SQLModel.metadata.create_all(
+        connection,
+        tables=[t for t in SQLModel.metadata.sorted_tables if t.name != TABLE],
+    )
+    if inspect(connection).has_table(TABLE):
+        return
+
+    # No default partition: Postgres cannot DETACH ... CONCURRENTLY next to
+    # one, and any row in it blocks creating the partition of its month.
+    # Inserts past the last partition fail instead, ensure_partitions runs on
+    # every migrate and archive-transactions, and worker start creates the
+    # current and next month's when a run was missed.
+    table = partitioned_table()
+    connection.execute(CreateTable(table, include_foreign_key_constraints=[]))
+    for index in table.indexes:
+        connection.execute(CreateIndex(index))
+    for constraint in table.foreign_key_constraints:
+        for element in constraint.elements:
+            referred_table, referred_column = element.target_fullname.split(".")
+            connection.execute(
+                text(
+                    f'ALTER TABLE "{TABLE}" ADD FOREIGN KEY ({element.parent.name}) '
+                    f'REFERENCES "{referred_table}" ({referred_column})'
+                )
+            )
+
+
+def create_partition(connection, month: datetime.datetime):
+    end = add_months(month, 1)
+    connection.execute(
+        text(
+            f'CREATE TABLE IF NOT EXISTS "{partition_name(month)}" '
+            f'PARTITION OF "{TABLE}" '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')"
+        )
+    )
+
+
+def ensure_partitions(connection, now: datetime.datetime | None = None):
+    # monthly partitions from the current month to TRANSACTION_PARTITIONS_AHEAD
+    # months out
+    if connection.dialect.name != "postgresql":
+        return
+
+    default = f"{TABLE}_default"
+    if inspect(connection).has_table(default):
+        drop_default_partition(connection, default)
+
+    month = month_start(now or datetime.datetime.now())
+    for _ in range(settings.TRANSACTION_PARTITIONS_AHEAD + 1):
+        create_partition(connection, month)
+        month = add_months(month, 1)
+
+
+def missing_partitions(
+    connection, now: datetime.datetime | None = None
+) -> list[datetime.datetime]:
+    # the current and next month, which inserts need until archive-transactions
+    # runs again, if their partitions are not there
+    if connection.dialect.name != "postgresql":
+        return []
+
+    month = month_start(now or datetime.datetime.now())
+    inspector = inspect(connection)
+    return [
+        month
+        for month in (month, add_months(month, 1))
+        if not inspector.has_table(partition_name(month))
+    ]
+
+
+def drop_default_partition(connection, default: str):
+    # Databases created with a default partition: its rows move into monthly
+    # partitions of their own, then it goes. Detached first, as no partition
+    # can be created for a month with rows in the default one.
+    connection.execute(text(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{default}"'))
+    months = connection.execute(
+        text(f"SELECT DISTINCT date_trunc('month', created_at) FROM \"{default}\"")
+    ).scalars()
+    for month in months:
+        create_partition(connection, month)
+
+    moved = connection.execute(
+        text(f'INSERT INTO "{TABLE}" SELECT * FROM "{default}"')
+    ).rowcount
+    connection.execute(text(f'DROP TABLE "{default}"'))
+    logger.info("moved %d transactions out of the default partition", moved)
+
+
+async def detach_partition(name: str):
+    # DETACH ... CONCURRENTLY only takes a SHARE UPDATE EXCLUSIVE lock, so
+    # ledger reads and writes carry on, but it cannot run inside a
+    # transaction block. A detach interrupted half-way leaves the partition
+    # pending, FINALIZE completes it.
+    async with models.engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        result = await connection.execute(
+            text(
+                "SELECT inhdetachpending FROM pg_inherits "
+                "WHERE inhrelid = CAST(:name AS regclass)"
+            ),
+            dict(name=f'"{name}"'),
+        )
+        pending = result.scalar()
+        if pending is not None:
+            mode = "FINALIZE" if pending else "CONCURRENTLY"
+            await connection.execute(
+                text(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}" {mode}')
+            )
+        await connection.execute(text(f'DROP TABLE "{name}"'))
+
+
+async def archive_closed(
+    session: models.AsyncSession, now: datetime.datetime | None = None
+) -> list[dict]:
+    # Moves every month older than TRANSACTION_HOT_MONTHS out of the hot table
+    # into the archive. On Postgres the month's partition is detached
+    # concurrently and dropped, on SQLite the month's rows are deleted.
+    cutoff = add_months(
+        month_start(now or datetime.datetime.now()), -settings.TRANSACTION_HOT_MONTHS
+    )
+
+    oldest = (
+        await session.exec(select(func.min(models.DBTransaction.created_at)))
+    ).first()
+    if oldest is None:
+        return []
+
+    is_postgresql = session.bind.dialect.name == "postgresql"
+    if is_postgresql:
+        connection = await session.connection()
+        existing = set(
+            await connection.run_sync(
+                lambda sync_connection: inspect(sync_connection).get_table_names()
+            )
+        )
+
+    entries = []
+    month = month_start(oldest)
+    while month < cutoff:
+        end = add_months(month, 1)
+        in_month = (
+            models.DBTransaction.created_at >= month,
+            models.DBTransaction.created_at < end,
+        )
+
+        result = await session.stream(
+            select(*models.DBTransaction.__table__.columns)
+            .where(*in_month)
+            .order_by(models.DBTransaction.id)
+            .execution_options(yield_per=ARCHIVE_CHUNK_SIZE)
+        )
+        with archive.MonthWriter(month, end) as writer:
+            async for rows in result.partitions():
+                writer.write([row._asdict() for row in rows])
+        logger.info("archived %d transactions of %s", writer.entry["count"], month)
+
+        name = partition_name(month)
+        if is_postgresql and name in existing:
+            # ends the read, the detach waits for transactions still seeing
+            # the partition
+            await session.commit()
+            await detach_partition(name)
+        else:
+            await session.exec(delete(models.DBTransaction).where(*in_month))
+            await session.commit()
+
+        entries.append(writer.entry)
+        month = end
+
+    return entries
@@ -0,0 +1,66 @@
+import os
+import time
+
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class PoolWaitMonitor:
+    """Exponentially weighted average of how long checkouts wait for a pooled
+    connection. The average decays with `half_life` while nothing is measured,
+    so a quiet period reads as an idle pool."""
+
+    def __init__(self, alpha: float = 0.2, half_life: float = 2.0):
+        self.alpha = alpha
+        self.half_life = half_life
+
+        self._average = 0.0
+        self._updated = time.monotonic()
+
+    def record(self, seconds: float):
+        self._average = self.current() * (1 - self.alpha) + seconds * self.alpha
+        self._updated = time.monotonic()
+
+    def current(self) -> float:
+        elapsed = time.monotonic() - self._updated
+        return self._average * 0.5 ** (elapsed / self.half_life)
+
+
+pool_wait = PoolWaitMonitor()
+
+
+class MonitoredPool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        # Only a pool at pool_size + max_overflow blocks on its queue, below
+        # that a checkout may open a connection, which is connect latency and
+        # not a wait, so it is recorded as none.
+        if not self.at_limit():
+            pool_wait.record(0.0)
+            return super()._do_get()
+
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait.record(time.perf_counter() - started)
+
+    def at_limit(self) -> bool:
+        return -1 < self._max_overflow <= self._overflow
+
+
+def worker_count(settings) -> int:
+    return settings.WORKERS or os.cpu_count() or 1
+
+
+def pool_options(settings) -> dict:
+    # Splits DB_CONNECTION_BUDGET evenly between the workers of digimon.runner,
+    # with one share held back for the extra worker alive during a rolling
+    # restart. A process not started by the runner gets all of it. No
+    # overflow, so the budget is a hard limit.
+    if not settings.DB_CONNECTION_BUDGET:
+        return {}
+
+    if not settings.RUNNER_WORKERS:
+        return dict(pool_size=settings.DB_CONNECTION_BUDGET, max_overflow=0)
+
+    size = max(settings.DB_CONNECTION_BUDGET // (settings.RUNNER_WORKERS + 1), 1)
+    return dict(pool_size=size, max_overflow=0)
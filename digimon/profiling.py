@@ -0,0 +1,60 @@
+import collections
+import sys
+import threading
+import time
+
+
+class SamplingProfiler:
+    """Samples the stacks of every other thread of the process at a fixed
+    interval, from a thread of its own so the event loop keeps serving.
+    Results are in the collapsed-stack format read by flamegraph.pl and
+    speedscope, one `frame;frame;frame count` line per distinct stack."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def sample(self, seconds: float) -> str | None:
+        # one profile at a time, None when one is already running
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return collapse(self._collect(seconds))
+        finally:
+            self._lock.release()
+
+    def _collect(self, seconds: float) -> collections.Counter:
+        own_thread = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = collections.Counter()
+
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stacks[(names.get(thread_id, str(thread_id)), *walk(frame))] += 1
+            time.sleep(self.interval)
+
+        return stacks
+
+
+def walk(frame) -> list[str]:
+    # outermost frame first
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}")
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def collapse(stacks: collections.Counter) -> str:
+    return "".join(
+        f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common()
+    )
@@ -0,0 +1,283 @@
+import datetime
+import logging
+
+from sqlalchemy import case, delete, func, text, update
+from sqlmodel import select
+
+from . import archive
+from . import models
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("hour", "day")
+
+REBUILD_CHUNK_SIZE = 5000
+UPSERT_CHUNK_SIZE = 500
+
+MERCHANT_KEYS = ("merchant_id", "granularity", "bucket")
+WALLET_KEYS = ("wallet_id", "direction", "granularity", "bucket")
+
+BUCKET_LENGTHS = dict(hour=datetime.timedelta(hours=1), day=datetime.timedelta(days=1))
+
+
+def truncate(timestamp: datetime.datetime, granularity: str) -> datetime.datetime:
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def aggregate(rows: list[dict], key) -> dict[tuple, dict]:
+    # folds rows into count/sum/min/max per (key(row), granularity, bucket)
+    buckets = {}
+    for row in rows:
+        keys = key(row)
+        for granularity in GRANULARITIES:
+            bucket = truncate(row["created_at"], granularity)
+            amount = row["amount"]
+            for k in keys:
+                metrics = buckets.get((*k, granularity, bucket))
+                if metrics is None:
+                    buckets[(*k, granularity, bucket)] = dict(
+                        count=1, total=amount, min_amount=amount, max_amount=amount
+                    )
+                    continue
+                metrics["count"] += 1
+                metrics["total"] += amount
+                metrics["min_amount"] = min(metrics["min_amount"], amount)
+                metrics["max_amount"] = max(metrics["max_amount"], amount)
+    return buckets
+
+
+async def aggregate_rows(
+    session: models.AsyncSession, rows: list[dict]
+) -> tuple[dict[tuple, dict], dict[tuple, dict]]:
+    # merchant and wallet buckets of the rows
+    if not rows:
+        return {}, {}
+
+    merchant_buckets = aggregate(
+        rows,
+        lambda row: [(row["merchant_id"],)] if row.get("merchant_id") else [],
+    )
+
+    owners = {row["sender"] for row in rows} | {row["receiver"] for row in rows}
+    result = await session.exec(
+        select(models.DBWallet.owner, models.DBWallet.id).where(
+            models.DBWallet.owner.in_(owners)
+        )
+    )
+    wallet_ids = dict(result.all())
+
+    def wallet_keys(row):
+        keys = []
+        if row["sender"] in wallet_ids:
+            keys.append((wallet_ids[row["sender"]], "out"))
+        if row["receiver"] in wallet_ids:
+            keys.append((wallet_ids[row["receiver"]], "in"))
+        return keys
+
+    return merchant_buckets, aggregate(rows, wallet_keys)
+
+
+async def apply(session: models.AsyncSession, rows: list[dict]):
+    # Called in the same database transaction that writes the ledger rows, so
+    # rollups never drift from the transactions they summarise.
+    merchant_buckets, wallet_buckets = await aggregate_rows(session, rows)
+
+    await upsert(session, models.DBMerchantRollup, MERCHANT_KEYS, merchant_buckets)
+    await upsert(session, models.DBWalletRollup, WALLET_KEYS, wallet_buckets)
+
+
+async def replace(
+    session: models.AsyncSession, old_rows: list[dict], new_rows: list[dict]
+):
+    # Ledger rows edited (old -> new) or deleted (new_rows empty) after they
+    # were rolled up. Called in the transaction of the edit, once it is
+    # flushed: counts and totals move by the difference, min/max of every
+    # touched bucket are recomputed from the ledger as the amount taken out
+    # may have been either. Buckets left without transactions are removed.
+    old = await aggregate_rows(session, old_rows)
+    new = await aggregate_rows(session, new_rows)
+
+    for model, keys, removed, added in zip(
+        (models.DBMerchantRollup, models.DBWalletRollup),
+        (MERCHANT_KEYS, WALLET_KEYS),
+        old,
+        new,
+    ):
+        buckets = difference(removed, added)
+        await upsert(session, model, keys, buckets)
+        for key in sorted(buckets):
+            await recompute_extremes(session, model, dict(zip(keys, key)))
+
+
+def difference(removed: dict, added: dict) -> dict[tuple, dict]:
+    buckets = {key: dict(metrics) for key, metrics in added.items()}
+    for key, metrics in removed.items():
+        bucket = buckets.setdefault(
+            key,
+            dict(
+                count=0,
+                total=0,
+                min_amount=metrics["min_amount"],
+                max_amount=metrics["max_amount"],
+            ),
+        )
+        bucket["count"] -= metrics["count"]
+        bucket["total"] -= metrics["total"]
+    return buckets
+
+
+async def recompute_extremes(session: models.AsyncSession, model, key: dict):
+    start = key["bucket"]
+    transaction = models.DBTransaction
+    where = [
+        transaction.created_at >= start,
+        transaction.created_at < start + BUCKET_LENGTHS[key["granularity"]],
+    ]
+    if model is models.DBMerchantRollup:
+        where.append(transaction.merchant_id == key["merchant_id"])
+    else:
+        owner = (
+            select(models.DBWallet.owner)
+            .where(models.DBWallet.id == key["wallet_id"])
+            .scalar_subquery()
+        )
+        if key["direction"] == "out":
+            where.append(transaction.sender == owner)
+        else:
+            where.append(transaction.receiver == owner)
+
+    result = await session.exec(
+        select(
+            func.count(), func.min(transaction.amount), func.max(transaction.amount)
+        ).where(*where)
+    )
+    count, min_amount, max_amount = result.one()
+
+    match = [getattr(model, name) == value for name, value in key.items()]
+    if count:
+        await session.exec(
+            update(model)
+            .where(*match)
+            .values(min_amount=min_amount, max_amount=max_amount)
+        )
+    else:
+        await session.exec(delete(model).where(*match))
+
+
+async def upsert(session: models.AsyncSession, model, keys: tuple, buckets: dict):
+    if not buckets:
+        return
+
+    # only the dialect in use gets imported
+    if session.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    table = model.__table__
+    # in key order, concurrent writers lock rollup rows in the same order and
+    # cannot deadlock on each other
+    rows = [
+        dict(zip(keys, key), **metrics) for key, metrics in sorted(buckets.items())
+    ]
+
+    # bounded so a single statement stays under the bind parameter limits
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        stmt = insert(table).values(rows[start : start + UPSERT_CHUNK_SIZE])
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_=dict(
+                count=table.c["count"] + excluded["count"],
+                total=table.c["total"] + excluded["total"],
+                min_amount=case(
+                    (
+                        excluded["min_amount"] < table.c["min_amount"],
+                        excluded["min_amount"],
+                    ),
+                    else_=table.c["min_amount"],
+                ),
+                max_amount=case(
+                    (
+                        excluded["max_amount"] > table.c["max_amount"],
+                        excluded["max_amount"],
+                    ),
+                    else_=table.c["max_amount"],
+                ),
+            ),
+        )
+        await session.exec(stmt)
+
+
+async def rebuild(session: models.AsyncSession) -> int:
+    # Backfill from the raw ledger, walked in id order in fixed-size chunks.
+    # The caller commits, so readers see either the old or the new rollups.
+    # Ledger writes wait until then: on Postgres through a SHARE lock on the
+    # transaction table, on SQLite the delete below already holds the write
+    # lock. Otherwise rows committed mid-rebuild would be counted twice.
+    if session.bind.dialect.name == "postgresql":
+        await session.exec(
+            text(f'LOCK TABLE "{models.DBTransaction.__tablename__}" IN SHARE MODE')
+        )
+
+    # Archived months are no longer in the ledger, their buckets are kept as
+    # they are. The archive cutoff is a month start, so no bucket straddles it.
+    cutoff = archive.cutoff()
+    for model in (models.DBMerchantRollup, models.DBWalletRollup):
+        stmt = delete(model)
+        if cutoff:
+            stmt = stmt.where(model.bucket >= cutoff)
+        await session.exec(stmt)
+    in_ledger = [models.DBTransaction.created_at >= cutoff] if cutoff else []
+
+    columns = (
+        models.DBTransaction.id,
+        models.DBTransaction.sender,
+        models.DBTransaction.receiver,
+        models.DBTransaction.amount,
+        models.DBTransaction.merchant_id,
+        models.DBTransaction.created_at,
+    )
+
+    last_id = 0
+    count = 0
+    while True:
+        result = await session.exec(
+            select(*columns)
+            .where(models.DBTransaction.id > last_id)
+            .where(*in_ledger)
+            .order_by(models.DBTransaction.id)
+            .limit(REBUILD_CHUNK_SIZE)
+        )
+        rows = [row._asdict() for row in result.all()]
+        if not rows:
+            break
+
+        await apply(session, rows)
+        last_id = rows[-1]["id"]
+        count += len(rows)
+        logger.info("rollups rebuilt up to transaction %d", last_id)
+
+    return count
+
+
+async def read_buckets(
+    session: models.AsyncSession,
+    model,
+    granularity: str,
+    since: datetime.datetime | None = None,
+    until: datetime.datetime | None = None,
+    **keys,
+) -> list:
+    stmt = select(model).where(model.granularity == granularity)
+    for name, value in keys.items():
+        stmt = stmt.where(getattr(model, name) == value)
+    if since:
+        stmt = stmt.where(model.bucket >= truncate(since, granularity))
+    if until:
+        stmt = stmt.where(model.bucket <= until)
+
+    result = await session.exec(stmt.order_by(model.bucket))
+    return result.all()
@@ -1,13 +1,19 @@
-from . import root
-from . import users
-from . import items
-from . import merchants
-from . import authentication
+import importlib
+
+# in include order, imported when the app is built rather than with the
+# package, so importing one router (tests, commands) does not load them all
+ROUTERS = [
+    "root",
+    "users",
+    "authentication",
+    "items",
+    "merchants",
+    "transactions",
+    "wallets",
+    "debug",
+]
 
 
 def init_router(app):
-    app.include_router(root.router)
-    app.include_router(users.router)
-    app.include_router(authentication.router)
-    app.include_router(items.router)
-    app.include_router(merchants.router)
\ No newline at end of file
+    for name in ROUTERS:
+        app.include_router(importlib.import_module(f".{name}", __name__).router)
@@ -5,8 +5,10 @@ from typing import Annotated
 import datetime
 
 from .. import config
+from .. import logins
 from .. import models
 from .. import security
+from .. import tracing
 
 router = APIRouter(tags=["authentication"])
 
@@ -20,25 +22,29 @@ async def authenticate_user(
     # Retrieve user by username
     user = await get_user_by_username_or_email(form_data.username, session)
     
-    if not user or not await user.verify_password(form_data.password):
+    verified = False
+    if user:
+        with tracing.span("bcrypt.checkpw"):
+            verified = await user.verify_password(form_data.password)
+
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password"
         )
     
-    # Update the last login date
-    user.last_login_date = datetime.datetime.now()
-    session.add(user)
-    await session.commit()
-    await session.refresh(user)
+    # Update the last login date, written behind in batches
+    login_date = datetime.datetime.now()
+    logins.last_login_buffer.record(user.id, login_date)
     
     # Create tokens
     access_token_expires = datetime.timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = security.create_access_token(
-        data={"sub": user.id}, expires_delta=access_token_expires
+        data=security.user_claims(user), expires_delta=access_token_expires
     )
     refresh_token = security.create_refresh_token(
-        data={"sub": user.id}, expires_delta=access_token_expires
+        data={"sub": str(user.id), "ver": user.token_version},
+        expires_delta=access_token_expires,
     )
     
     return models.Token(
@@ -48,7 +54,7 @@ async def authenticate_user(
         scope="",
         expires_in=settings.ACCESS_TOKEN_EXPIRE_MINUTES,
         expires_at=datetime.datetime.now() + access_token_expires,
-        issued_at=user.last_login_date,
+        issued_at=login_date,
         user_id=user.id
     )
 
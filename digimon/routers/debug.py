@@ -0,0 +1,31 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import PlainTextResponse
+import asyncio
+import os
+
+from .. import config, models, deps, profiling
+
+settings = config.get_settings()
+
+router = APIRouter(prefix="/debug")
+
+profiler = profiling.SamplingProfiler(settings.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    current_user: models.TokenClaims = Depends(deps.get_current_active_superuser),
+    seconds: int = Query(10, ge=1, le=settings.PROFILE_MAX_SECONDS),
+) -> PlainTextResponse:
+    # samples the worker that serves this request, X-Worker-Pid tells which
+    stacks = await asyncio.to_thread(profiler.sample, seconds)
+    if stacks is None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+    return PlainTextResponse(
+        stacks,
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{os.getpid()}.collapsed"',
+            "X-Worker-Pid": str(os.getpid()),
+        },
+    )
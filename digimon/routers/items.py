@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
 from typing import Optional, Annotated
 from sqlmodel import select, func
 from sqlmodel.ext.asyncio.session import AsyncSession
@@ -40,7 +40,7 @@ async def create_item(
     current_user: Annotated[models.User, Depends(deps.get_current_user)],
     session: Annotated[AsyncSession, Depends(models.get_session)],
 ) -> models.Item:
-    dbitem = models.DBItem.validate_model(item)
+    dbitem = models.DBItem.model_validate(item)
     session.add(dbitem)
     await session.commit()
     await session.refresh(dbitem)
@@ -49,10 +49,13 @@ async def create_item(
 
 @router.get("/{item_id}")
 async def read_item(
-    item_id: int, session: Annotated[AsyncSession, Depends(models.get_session)]
+    item_id: int,
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+    response: Response,
 ) -> models.Item:
     db_item = await session.get(models.DBItem, item_id)
     if db_item:
+        response.headers["ETag"] = deps.etag(db_item.version)
         return models.Item.from_orm(db_item)
 
     raise HTTPException(status_code=404, detail="Item not found")
@@ -63,17 +66,19 @@ async def update_item(
     item: models.UpdatedItem,
     current_user: Annotated[models.User, Depends(deps.get_current_user)],
     session: Annotated[AsyncSession, Depends(models.get_session)],
+    response: Response,
+    if_match: Annotated[Optional[int], Depends(deps.get_if_match)],
 ) -> models.Item:
     logger.debug("update_item data: %s", item)
-    db_item = await session.get(models.DBItem, item_id)
-    if not db_item:
-        raise HTTPException(status_code=404, detail="Item not found")
-
-    data = item.model_dump()
-    db_item.sqlmodel_update(data)
-    session.add(db_item)
-    await session.commit()
-    await session.refresh(db_item)
+    db_item = await deps.update_or_fail(
+        session,
+        models.DBItem,
+        item_id,
+        item.model_dump(),
+        if_match,
+        response,
+        detail="Item not found",
+    )
 
     return models.Item.from_orm(db_item)
 
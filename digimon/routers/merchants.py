@@ -1,9 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import Annotated
+from fastapi import APIRouter, HTTPException, Depends, Response
+from typing import Optional, Annotated
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.exc import IntegrityError
+import datetime
 
-from .. import models, deps
+from .. import models, deps, rollups
 
 router = APIRouter(prefix="/merchants")
 
@@ -34,29 +36,58 @@ async def read_merchants(
 
 @router.get("/{merchant_id}")
 async def read_merchant(
-    merchant_id: int, session: Annotated[AsyncSession, Depends(models.get_session)]
+    merchant_id: int,
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+    response: Response,
 ) -> models.Merchant:
     db_merchant = await session.get(models.DBMerchant, merchant_id)
     if db_merchant:
+        response.headers["ETag"] = deps.etag(db_merchant.version)
         return models.Merchant.model_validate(db_merchant)
     raise HTTPException(status_code=404, detail="Merchant not found")
 
+@router.get("/{merchant_id}/stats")
+async def read_merchant_stats(
+    merchant_id: int,
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+    granularity: models.Granularity = "day",
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+) -> models.MerchantStats:
+    if await session.get(models.DBMerchant, merchant_id) is None:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+
+    buckets = await rollups.read_buckets(
+        session,
+        models.DBMerchantRollup,
+        granularity,
+        since,
+        until,
+        merchant_id=merchant_id,
+    )
+
+    return models.MerchantStats.model_validate(
+        dict(merchant_id=merchant_id, granularity=granularity, buckets=buckets)
+    )
+
 @router.put("/{merchant_id}")
 async def update_merchant(
     merchant_id: int,
     merchant: models.UpdatedMerchant,
     current_user: Annotated[models.User, Depends(deps.get_current_user)],
     session: Annotated[AsyncSession, Depends(models.get_session)],
+    response: Response,
+    if_match: Annotated[Optional[int], Depends(deps.get_if_match)],
 ) -> models.Merchant:
-    db_merchant = await session.get(models.DBMerchant, merchant_id)
-    if not db_merchant:
-        raise HTTPException(status_code=404, detail="Merchant not found")
-
-    data = merchant.model_dump()
-    db_merchant.sqlmodel_update(data)
-    session.add(db_merchant)
-    await session.commit()
-    await session.refresh(db_merchant)
+    db_merchant = await deps.update_or_fail(
+        session,
+        models.DBMerchant,
+        merchant_id,
+        merchant.model_dump(),
+        if_match,
+        response,
+        detail="Merchant not found",
+    )
 
     return models.Merchant.model_validate(db_merchant)
 
@@ -71,6 +102,12 @@ async def delete_merchant(
         raise HTTPException(status_code=404, detail="Merchant not found")
 
     await session.delete(db_merchant)
-    await session.commit()
+    try:
+        await session.commit()
+    except IntegrityError:
+        # its rollups go with it, items and transactions do not
+        raise HTTPException(
+            status_code=409, detail="Merchant still has items or transactions"
+        )
 
     return {"message": "delete success"}
@@ -1,58 +1,199 @@
-from fastapi import APIRouter, HTTPException
-from typing import Optional
-from sqlmodel import Field, SQLModel, create_engine, Session, select
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Optional, Annotated
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+import asyncio
+import datetime
 
-from ..models import Transaction, CreatedTransaction, TransactionList, DBTransaction, UpdatedTransaction, engine
+from .. import models, deps, ledger, archive, rollups
 
 router = APIRouter(prefix="/transactions")
 
-@router.get("", response_model=TransactionList)
-async def read_transactions(page: int = 1, page_size: int = 10) -> TransactionList:
-    with Session(engine) as session:
-        stmt = select(DBTransaction).offset((page - 1) * page_size).limit(page_size)
-        transactions = session.exec(stmt).all()
-        total_transactions = session.exec(select(DBTransaction)).count()  # คำนวณจำนวนรายการทั้งหมด
-    
-    return TransactionList(transactions=transactions, page=page, page_size=page_size, size_per_page=total_transactions)
-
-@router.post("", response_model=Transaction)
-async def create_transaction(transaction: CreatedTransaction) -> Transaction:
-    data = transaction.dict()
-    dbtransaction = DBTransaction(**data)
-    with Session(engine) as session:
-        session.add(dbtransaction)
-        session.commit()
-        session.refresh(dbtransaction)
-    return Transaction.from_orm(dbtransaction)
-
-@router.get("/{transaction_id}", response_model=Transaction)
-async def read_transaction(transaction_id: int) -> Transaction:
-    with Session(engine) as session:
-        db_transaction = session.get(DBTransaction, transaction_id)
-        if db_transaction:
-            return Transaction.from_orm(db_transaction)
-    raise HTTPException(status_code=404, detail="Transaction not found")
-
-@router.put("/{transaction_id}", response_model=Transaction)
-async def update_transaction(transaction_id: int, transaction: UpdatedTransaction) -> Transaction:
-    data = transaction.dict()
-    with Session(engine) as session:
-        db_transaction = session.get(DBTransaction, transaction_id)
-        if not db_transaction:
-            raise HTTPException(status_code=404, detail="Transaction not found")
-        for key, value in data.items():
-            setattr(db_transaction, key, value)
-        session.add(db_transaction)
-        session.commit()
-        session.refresh(db_transaction)
-    return Transaction.from_orm(db_transaction)
+@router.get("")
+async def read_transactions(
+    current_user: Annotated[
+        models.TokenClaims, Depends(deps.get_current_active_superuser)
+    ],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+    page: Optional[int] = Query(1, ge=1),
+    page_size: Optional[int] = Query(10, ge=1),
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+) -> models.TransactionList:
+    offset = (page - 1) * page_size
+    transactions = []
+    archived_total = 0
+
+    # history older than the hot table is served from the archive files,
+    # archived rows come first as they are the oldest
+    cutoff = archive.cutoff()
+    if cutoff and (since is None or since < cutoff):
+        transactions, archived_total = await asyncio.to_thread(
+            archive.read_page,
+            since,
+            min(until, cutoff) if until else cutoff,
+            offset,
+            page_size,
+        )
+
+    stmt = select(models.DBTransaction)
+    count_stmt = select(func.count(models.DBTransaction.id))
+    if cutoff:
+        # whatever is left of an archived month is counted once, from the archive
+        stmt = stmt.where(models.DBTransaction.created_at >= cutoff)
+        count_stmt = count_stmt.where(models.DBTransaction.created_at >= cutoff)
+    if since:
+        stmt = stmt.where(models.DBTransaction.created_at >= since)
+        count_stmt = count_stmt.where(models.DBTransaction.created_at >= since)
+    if until:
+        stmt = stmt.where(models.DBTransaction.created_at < until)
+        count_stmt = count_stmt.where(models.DBTransaction.created_at < until)
+
+    if len(transactions) < page_size:
+        result = await session.exec(
+            stmt.order_by(models.DBTransaction.id)
+            .offset(max(offset - archived_total, 0))
+            .limit(page_size - len(transactions))
+        )
+        transactions.extend(result.all())
+
+    # คำนวณจำนวนรายการทั้งหมด
+    total_items = await session.exec(count_stmt)
+
+    return models.TransactionList.model_validate(
+        dict(
+            transactions=transactions,
+            page=page,
+            page_size=page_size,
+            total_items=archived_total + total_items.first(),
+        )
+    )
+
+def check_senders(current_user: models.User, transactions: list) -> None:
+    # only admins pay out of wallets they do not own
+    if "admin" in current_user.roles:
+        return
+
+    foreign = {
+        transaction.sender
+        for transaction in transactions
+        if transaction.sender != current_user.username
+    }
+    if foreign:
+        raise HTTPException(
+            status_code=403,
+            detail=f"Not allowed to debit wallets: {', '.join(sorted(foreign))}",
+        )
+
+@router.post("")
+async def create_transaction(
+    transaction: models.CreatedTransaction,
+    current_user: Annotated[models.User, Depends(deps.get_current_active_user)],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+) -> models.Transaction:
+    # moves the balances like a batch of one
+    check_senders(current_user, [transaction])
+    data = transaction.model_dump()
+
+    if ledger.transaction_batcher.running:
+        try:
+            outcome = await ledger.transaction_batcher.submit(data)
+        except ledger.TransactionRejected as e:
+            outcome = str(e)
+    else:
+        [outcome] = await ledger.settle(session, [data], best_effort=True)
+        await session.commit()
+
+    if not isinstance(outcome, int):
+        raise HTTPException(status_code=400, detail=outcome)
+
+    return models.Transaction(id=outcome, **data)
+
+@router.post("/batch")
+async def create_transactions_batch(
+    batch: models.BatchTransaction,
+    current_user: Annotated[models.User, Depends(deps.get_current_active_user)],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+) -> models.BatchTransactionResult:
+    check_senders(current_user, batch.transactions)
+
+    legs = [transaction.model_dump() for transaction in batch.transactions]
+    transactions, rejected = await ledger.apply_batch(
+        session, legs, best_effort=batch.mode == "best_effort"
+    )
+
+    if rejected and batch.mode == "all_or_nothing":
+        await session.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail=[transaction.model_dump() for transaction in rejected],
+        )
+
+    await session.commit()
+
+    return models.BatchTransactionResult(transactions=transactions, rejected=rejected)
+
+@router.get("/{transaction_id}")
+async def read_transaction(
+    transaction_id: int,
+    current_user: Annotated[models.User, Depends(deps.get_current_active_user)],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+) -> models.Transaction:
+    transaction = await session.get(models.DBTransaction, transaction_id)
+    if transaction is None:
+        transaction = await asyncio.to_thread(archive.find, transaction_id)
+    if transaction is not None:
+        transaction = models.Transaction.model_validate(transaction)
+
+    # other users' transactions are reported as missing
+    if transaction is None or (
+        "admin" not in current_user.roles
+        and current_user.username not in (transaction.sender, transaction.receiver)
+    ):
+        raise HTTPException(status_code=404, detail="Transaction not found")
+
+    return transaction
+
+@router.put("/{transaction_id}")
+async def update_transaction(
+    transaction_id: int,
+    transaction: models.UpdatedTransaction,
+    current_user: Annotated[
+        models.TokenClaims, Depends(deps.get_current_active_superuser)
+    ],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+) -> models.Transaction:
+    db_transaction = await session.get(models.DBTransaction, transaction_id)
+    if not db_transaction:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+
+    old_row = db_transaction.model_dump()
+    db_transaction.sqlmodel_update(transaction.model_dump())
+    session.add(db_transaction)
+    await session.flush()
+    # the rollups move with the ledger, in the same transaction
+    await rollups.replace(session, [old_row], [db_transaction.model_dump()])
+    await session.commit()
+    await session.refresh(db_transaction)
+
+    return models.Transaction.model_validate(db_transaction)
 
 @router.delete("/{transaction_id}")
-async def delete_transaction(transaction_id: int) -> dict:
-    with Session(engine) as session:
-        db_transaction = session.get(DBTransaction, transaction_id)
-        if not db_transaction:
-            raise HTTPException(status_code=404, detail="Transaction not found")
-        session.delete(db_transaction)
-        session.commit()
+async def delete_transaction(
+    transaction_id: int,
+    current_user: Annotated[
+        models.TokenClaims, Depends(deps.get_current_active_superuser)
+    ],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+) -> dict:
+    db_transaction = await session.get(models.DBTransaction, transaction_id)
+    if not db_transaction:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+
+    old_row = db_transaction.model_dump()
+    await session.delete(db_transaction)
+    await session.flush()
+    await rollups.replace(session, [old_row], [])
+    await session.commit()
+
     return {"message": "delete success"}
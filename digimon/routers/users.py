@@ -1,22 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel import select
+from sqlalchemy import case
 
-from typing import Annotated
+from typing import Annotated, Optional
 
 from .. import deps
 from .. import models
+from .. import security
+from .. import tracing
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 @router.get("/me")
-async def get_me(current_user: models.User = Depends(deps.get_current_user)) -> models.User:
+async def get_me(
+    response: Response,
+    current_user: models.User = Depends(deps.get_current_user),
+) -> models.User:
+    response.headers["ETag"] = deps.etag(current_user.version)
     return current_user
 
 @router.get("/{user_id}")
 async def get(
     user_id: str,
     session: Annotated[AsyncSession, Depends(models.get_session)],
+    response: Response,
     current_user: models.User = Depends(deps.get_current_user),
 ) -> models.User:
     user = await session.get(models.DBUser, user_id)
@@ -25,6 +33,7 @@ async def get(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found",
         )
+    response.headers["ETag"] = deps.etag(user.version)
     return user
 
 @router.post("/create")
@@ -44,7 +53,8 @@ async def create(
         )
 
     user = models.DBUser.from_orm(user_info)
-    await user.set_password(user_info.password)
+    with tracing.span("bcrypt.hashpw"):
+        await user.set_password(user_info.password)
     session.add(user)
     await session.commit()
 
@@ -65,37 +75,91 @@ async def change_password(
             detail="User not found",
         )
 
-    if not await user.verify_password(password_update.current_password):
+    with tracing.span("bcrypt.checkpw"):
+        verified = await user.verify_password(password_update.current_password)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect current password",
         )
 
-    await user.set_password(password_update.new_password)
-    session.add(user)
+    with tracing.span("bcrypt.hashpw"):
+        password = await user.get_encrypted_password(password_update.new_password)
+
+    # bumped in SQL, and only if the password is still the one verified above,
+    # so a concurrent change can neither be lost nor lose its revocation
+    db_user = await models.update_versioned(
+        session,
+        models.DBUser,
+        user.id,
+        dict(
+            password=password,
+            token_version=models.DBUser.token_version + 1,
+        ),
+        None,
+        models.DBUser.password == user.password,
+    )
+
+    if db_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Password was changed concurrently",
+        )
+
     await session.commit()
 
+    security.revoke_tokens(db_user.id, db_user.token_version)
+
     return {"message": "Password changed successfully"}
 
 @router.put("/{user_id}/update")
 async def update(
-    user_id: str,
+    user_id: int,
     user_update: models.UpdatedUser,
     session: Annotated[AsyncSession, Depends(models.get_session)],
+    response: Response,
+    if_match: Annotated[Optional[int], Depends(deps.get_if_match)],
     current_user: models.User = Depends(deps.get_current_user),
 ) -> models.User:
-    db_user = await session.get(models.DBUser, user_id)
+    role_mask = models.encode_roles(user_update.roles)
+    values = user_update.model_dump(exclude={"roles"})
+    where = []
+
+    if "admin" in current_user.roles:
+        # a change of roles revokes the tokens carrying the old ones
+        values["role_mask"] = role_mask
+        values["token_version"] = case(
+            (models.DBUser.role_mask != role_mask, models.DBUser.token_version + 1),
+            else_=models.DBUser.token_version,
+        )
+    else:
+        # only admins change roles, anyone else must send them unchanged
+        where.append(models.DBUser.role_mask == role_mask)
+
+    db_user = await models.update_versioned(
+        session, models.DBUser, user_id, values, if_match, *where
+    )
 
-    if not db_user:
+    if db_user is None:
+        existing = await session.get(models.DBUser, user_id)
+        if not existing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found",
+            )
+        if existing.role_mask != role_mask and "admin" not in current_user.roles:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Role not permitted",
+            )
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found",
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="Precondition failed",
         )
 
-    # Assuming user_update contains fields to be updated directly
-    db_user = db_user.copy(update=user_update.dict())
-    session.add(db_user)
     await session.commit()
-    await session.refresh(db_user)
+
+    security.revoke_tokens(db_user.id, db_user.token_version)
+    response.headers["ETag"] = deps.etag(db_user.version)
 
     return db_user
@@ -1,58 +1,142 @@
-from fastapi import APIRouter, HTTPException
-from typing import Optional
-from sqlmodel import Field, SQLModel, create_engine, Session, select
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from typing import Optional, Annotated
+from sqlmodel import select, func
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.exc import IntegrityError
+import datetime
 
-from ..models import Wallet, CreatedWallet, WalletList, DBWallet, UpdatedWallet, engine
+from .. import models, deps, rollups
 
 router = APIRouter(prefix="/wallets")
 
-@router.get("", response_model=WalletList)
-async def read_wallets(page: int = 1, page_size: int = 10) -> WalletList:
-    with Session(engine) as session:
-        stmt = select(DBWallet).offset((page - 1) * page_size).limit(page_size)
-        wallets = session.exec(stmt).all()
-        total_wallets = session.exec(select(DBWallet)).count()  # คำนวณจำนวนรายการทั้งหมด
-    
-    return WalletList(wallets=wallets, page=page, page_size=page_size, size_per_page=total_wallets)
-
-@router.post("", response_model=Wallet)
-async def create_wallet(wallet: CreatedWallet) -> Wallet:
-    data = wallet.dict()
-    dbwallet = DBWallet(**data)
-    with Session(engine) as session:
-        session.add(dbwallet)
-        session.commit()
-        session.refresh(dbwallet)
-    return Wallet.from_orm(dbwallet)
-
-@router.get("/{wallet_id}", response_model=Wallet)
-async def read_wallet(wallet_id: int) -> Wallet:
-    with Session(engine) as session:
-        db_wallet = session.get(DBWallet, wallet_id)
-        if db_wallet:
-            return Wallet.from_orm(db_wallet)
-    raise HTTPException(status_code=404, detail="Wallet not found")
-
-@router.put("/{wallet_id}", response_model=Wallet)
-async def update_wallet(wallet_id: int, wallet: UpdatedWallet) -> Wallet:
-    data = wallet.dict()
-    with Session(engine) as session:
-        db_wallet = session.get(DBWallet, wallet_id)
-        if not db_wallet:
-            raise HTTPException(status_code=404, detail="Wallet not found")
-        for key, value in data.items():
-            setattr(db_wallet, key, value)
-        session.add(db_wallet)
-        session.commit()
-        session.refresh(db_wallet)
-    return Wallet.from_orm(db_wallet)
+async def get_own_wallet(
+    session: AsyncSession, wallet_id: int, current_user: models.User
+) -> models.DBWallet:
+    # other users' wallets are reported as missing
+    db_wallet = await session.get(models.DBWallet, wallet_id)
+    if db_wallet is None or (
+        "admin" not in current_user.roles and db_wallet.owner != current_user.username
+    ):
+        raise HTTPException(status_code=404, detail="Wallet not found")
+    return db_wallet
+
+@router.get("")
+async def read_wallets(
+    current_user: Annotated[
+        models.TokenClaims, Depends(deps.get_current_active_superuser)
+    ],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+    page: Optional[int] = Query(1, ge=1),
+    page_size: Optional[int] = Query(10, ge=1),
+) -> models.WalletList:
+    result = await session.exec(
+        select(models.DBWallet).offset((page - 1) * page_size).limit(page_size)
+    )
+    wallets = result.all()
+
+    # คำนวณจำนวนรายการทั้งหมด
+    total_items = await session.exec(select(func.count(models.DBWallet.id)))
+
+    return models.WalletList.model_validate(
+        dict(
+            wallets=wallets,
+            page=page,
+            page_size=page_size,
+            total_items=total_items.first(),
+        )
+    )
+
+@router.post("")
+async def create_wallet(
+    wallet: models.CreatedWallet,
+    current_user: Annotated[
+        models.TokenClaims, Depends(deps.get_current_active_superuser)
+    ],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+) -> models.Wallet:
+    db_wallet = models.DBWallet.model_validate(wallet)
+    session.add(db_wallet)
+    try:
+        await session.commit()
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Wallet owner already exists")
+    await session.refresh(db_wallet)
+
+    return models.Wallet.model_validate(db_wallet)
+
+@router.get("/{wallet_id}")
+async def read_wallet(
+    wallet_id: int,
+    current_user: Annotated[models.User, Depends(deps.get_current_active_user)],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+    response: Response,
+) -> models.Wallet:
+    db_wallet = await get_own_wallet(session, wallet_id, current_user)
+    response.headers["ETag"] = deps.etag(db_wallet.version)
+    return models.Wallet.model_validate(db_wallet)
+
+@router.get("/{wallet_id}/stats")
+async def read_wallet_stats(
+    wallet_id: int,
+    current_user: Annotated[models.User, Depends(deps.get_current_active_user)],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+    granularity: models.Granularity = "day",
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+) -> models.WalletStats:
+    await get_own_wallet(session, wallet_id, current_user)
+    buckets = await rollups.read_buckets(
+        session, models.DBWalletRollup, granularity, since, until, wallet_id=wallet_id
+    )
+
+    return models.WalletStats.model_validate(
+        dict(
+            wallet_id=wallet_id,
+            granularity=granularity,
+            incoming=[bucket for bucket in buckets if bucket.direction == "in"],
+            outgoing=[bucket for bucket in buckets if bucket.direction == "out"],
+        )
+    )
+
+@router.put("/{wallet_id}")
+async def update_wallet(
+    wallet_id: int,
+    wallet: models.UpdatedWallet,
+    current_user: Annotated[
+        models.TokenClaims, Depends(deps.get_current_active_superuser)
+    ],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+    response: Response,
+    if_match: Annotated[Optional[int], Depends(deps.get_if_match)],
+) -> models.Wallet:
+    try:
+        db_wallet = await deps.update_or_fail(
+            session,
+            models.DBWallet,
+            wallet_id,
+            wallet.model_dump(),
+            if_match,
+            response,
+            detail="Wallet not found",
+        )
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Wallet owner already exists")
+
+    return models.Wallet.model_validate(db_wallet)
 
 @router.delete("/{wallet_id}")
-async def delete_wallet(wallet_id: int) -> dict:
-    with Session(engine) as session:
-        db_wallet = session.get(DBWallet, wallet_id)
-        if not db_wallet:
-            raise HTTPException(status_code=404, detail="Wallet not found")
-        session.delete(db_wallet)
-        session.commit()
+async def delete_wallet(
+    wallet_id: int,
+    current_user: Annotated[
+        models.TokenClaims, Depends(deps.get_current_active_superuser)
+    ],
+    session: Annotated[AsyncSession, Depends(models.get_session)],
+) -> dict:
+    db_wallet = await session.get(models.DBWallet, wallet_id)
+    if not db_wallet:
+        raise HTTPException(status_code=404, detail="Wallet not found")
+
+    await session.delete(db_wallet)
+    await session.commit()
+
     return {"message": "delete success"}
@@ -0,0 +1,266 @@
+"""Production runner, `python -m digimon.runner`.
+
+The master process imports and builds the app once, binds the listening
+socket and forks the workers, so the imported code and warm module state are
+shared copy-on-write. The master never touches the database, every worker
+opens its own pool (sized by pooling.pool_options) on first use.
+
+Per-process state (rate limits, fraud windows, cached token versions, login
+buffer) stays per worker.
+
+Signals to the master:
+    SIGTERM, SIGINT  drain the workers and exit
+    SIGHUP           rolling restart, one worker at a time: start a new one,
+                     wait until it serves, then drain the old one. Workers are
+                     forked from the preloaded master, so picking up new code
+                     takes a restart of the master itself.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+from . import config
+from . import pooling
+
+logger = logging.getLogger(__name__)
+
+READY_TIMEOUT_SECONDS = 60
+
+# exit code of a worker whose startup failed, e.g. on a schema version mismatch
+STARTUP_FAILURE = 3
+
+
+def bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def preload(settings):
+    from . import main
+
+    # imported lazily in a single process, here it is worth sharing numpy
+    # between the workers
+    if settings.FRAUD_SCORING:
+        from . import scoring
+
+    return main.create_app()
+
+
+async def notify_ready(server: uvicorn.Server, ready_fd: int):
+    while not server.started:
+        if server.should_exit:
+            return
+        await asyncio.sleep(0.05)
+    os.write(ready_fd, b"1")
+
+
+async def serve(server: uvicorn.Server, sock: socket.socket, ready_fd: int):
+    from . import models
+
+    # nothing is pooled before fork, this only makes sure of it
+    await models.engine.dispose(close=False)
+
+    ready = asyncio.create_task(notify_ready(server, ready_fd))
+    await server.serve(sockets=[sock])
+    ready.cancel()
+
+
+class Runner:
+    def __init__(self, uvicorn_config: uvicorn.Config, sock: socket.socket, settings):
+        self.uvicorn_config = uvicorn_config
+        self.sock = sock
+        self.workers_count = pooling.worker_count(settings)
+        self.shutdown_timeout = settings.WORKER_SHUTDOWN_TIMEOUT_SECONDS
+
+        # pid -> read end of the worker's readiness pipe
+        self.workers: dict[int, int] = {}
+        self.signals: list[int] = []
+
+    def run(self) -> int:
+        self._wakeup_read, wakeup_write = os.pipe()
+        os.set_blocking(wakeup_write, False)
+        signal.set_wakeup_fd(wakeup_write, warn_on_full_buffer=False)
+        self._wakeup_write = wakeup_write
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, self.handle_signal)
+
+        for pid in [self.spawn() for _ in range(self.workers_count)]:
+            if not self.wait_ready(pid):
+                logger.error("worker %d failed to start", pid)
+                self.stop()
+                return 1
+        logger.info("%d workers serving on %s", self.workers_count, self.sock.getsockname())
+
+        while True:
+            self.sleep()
+            if not self.reap():
+                self.stop()
+                return 1
+
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self.stop()
+                    return 0
+                if signum == signal.SIGHUP:
+                    self.restart()
+
+    def handle_signal(self, signum, frame):
+        if signum != signal.SIGCHLD:
+            self.signals.append(signum)
+
+    def sleep(self):
+        readable, _, _ = select.select([self._wakeup_read], [], [], 1.0)
+        if readable:
+            os.read(self._wakeup_read, 1024)
+
+    def spawn(self) -> int:
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            os._exit(self.run_worker(ready_write))
+
+        os.close(ready_write)
+        self.workers[pid] = ready_read
+        return pid
+
+    def run_worker(self, ready_fd: int) -> int:
+        from . import main
+
+        main.forked = time.perf_counter()
+        signal.set_wakeup_fd(-1)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        # a hangup of the terminal is for the master to handle
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        for fd in [self._wakeup_read, self._wakeup_write, *self.workers.values()]:
+            os.close(fd)
+
+        server = uvicorn.Server(self.uvicorn_config)
+        try:
+            asyncio.run(serve(server, self.sock, ready_fd))
+        except Exception:
+            logger.exception("worker %d crashed", os.getpid())
+            return 1
+        return 0 if server.started else STARTUP_FAILURE
+
+    def wait_ready(self, pid: int) -> bool:
+        # the pipe reads empty if the worker exits before it serves
+        readable, _, _ = select.select([self.workers[pid]], [], [], READY_TIMEOUT_SECONDS)
+        return bool(readable) and os.read(self.workers[pid], 1) == b"1"
+
+    def reap(self) -> bool:
+        # Replaces workers that died on their own. Returns False if a
+        # replacement cannot start, the master gives up instead of looping.
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            if pid not in self.workers:
+                continue
+
+            os.close(self.workers.pop(pid))
+            logger.warning(
+                "worker %d exited with status %d, replacing it",
+                pid,
+                os.waitstatus_to_exitcode(status),
+            )
+            replacement = self.spawn()
+            if not self.wait_ready(replacement):
+                logger.error("worker %d failed to start", replacement)
+                return False
+        return True
+
+    def restart(self):
+        logger.info("rolling restart of %d workers", len(self.workers))
+        for pid in list(self.workers):
+            replacement = self.spawn()
+            if not self.wait_ready(replacement):
+                logger.error(
+                    "worker %d failed to start, keeping the remaining workers",
+                    replacement,
+                )
+                self.terminate([replacement])
+                return
+            self.terminate([pid])
+        logger.info("rolling restart done")
+
+    def terminate(self, pids: list[int]):
+        # SIGTERM lets uvicorn finish in-flight requests and run the shutdown
+        # handlers (batcher, login buffer), SIGKILL only after the timeout
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.shutdown_timeout + 5
+        remaining = set(pids)
+        while remaining:
+            for pid in list(remaining):
+                if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                    remaining.discard(pid)
+                    os.close(self.workers.pop(pid))
+            if remaining and time.monotonic() > deadline:
+                for pid in remaining:
+                    logger.warning("worker %d did not stop in time, killing it", pid)
+                    os.kill(pid, signal.SIGKILL)
+                deadline = float("inf")
+            if remaining:
+                time.sleep(0.1)
+
+    def stop(self):
+        logger.info("stopping %d workers", len(self.workers))
+        self.terminate(list(self.workers))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="digimon.runner")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, help="overrides WORKERS, 0 starts one per CPU"
+    )
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s",
+    )
+
+    # the pool of every worker is sized from the resolved worker count
+    if args.workers is not None:
+        os.environ["WORKERS"] = str(args.workers)
+    settings = config.get_settings()
+    os.environ["RUNNER_WORKERS"] = str(pooling.worker_count(settings))
+    settings = config.get_settings()
+
+    sock = bind(args.host, args.port)
+    app = preload(settings)
+    uvicorn_config = uvicorn.Config(
+        app,
+        host=args.host,
+        port=args.port,
+        lifespan="on",
+        timeout_graceful_shutdown=settings.WORKER_SHUTDOWN_TIMEOUT_SECONDS,
+    )
+
+    sys.exit(Runner(uvicorn_config, sock, settings).run())
+
+
+if __name__ == "__main__":
+    main()
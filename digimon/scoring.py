@@ -0,0 +1,329 @@
+import collections
+import itertools
+import logging
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy import (
+    String,
+    column,
+    event,
+    literal,
+    true,
+    tuple_,
+    union_all,
+    update,
+    values,
+)
+from sqlmodel import select
+
+from . import config
+from . import models
+
+logger = logging.getLogger(__name__)
+
+settings = config.get_settings()
+
+RESCORE_CHUNK_SIZE = 5000
+# senders per UNION ALL where there is no LATERAL, SQLite caps compound selects
+LOAD_CHUNK_SIZE = 200
+
+# a score of 1.0 means one of the signals reached its configured limit
+FLAG_THRESHOLD = 1.0
+
+
+def score_arrays(
+    timestamps: np.ndarray,
+    amounts: np.ndarray,
+    receivers: np.ndarray,
+    window: int = settings.FRAUD_WINDOW_SIZE,
+) -> np.ndarray:
+    # Scores every transfer of one wallet against the (at most `window`)
+    # transfers before it. Inputs are in time order. The online and batch paths
+    # both go through here, so they agree by construction.
+    #
+    # Transfers sharing a timestamp were written together, the legs of one
+    # payout batch: velocity and fan-out count them as a single event.
+    n = len(amounts)
+    if n == 0:
+        return np.zeros(0)
+
+    index = np.arange(n)
+    start = np.maximum(index - window, 0)
+    count = index - start
+
+    new_event = np.ones(n, dtype=bool)
+    new_event[1:] = timestamps[1:] != timestamps[:-1]
+    event_index = np.cumsum(new_event) - 1
+    event_size = np.bincount(event_index)[event_index]
+
+    # rolling mean/std of the preceding amounts from prefix sums
+    csum = np.concatenate(([0.0], np.cumsum(amounts)))
+    csq = np.concatenate(([0.0], np.cumsum(amounts * amounts)))
+    safe_count = np.maximum(count, 1)
+    mean = (csum[index] - csum[start]) / safe_count
+    var = (csq[index] - csq[start]) / safe_count - mean * mean
+    std = np.maximum(np.sqrt(np.maximum(var, 0)), np.maximum(0.05 * np.abs(mean), 1e-9))
+    z = np.where(count >= settings.FRAUD_MIN_HISTORY, (amounts - mean) / std, 0.0)
+    amount_score = np.maximum(z, 0) / settings.FRAUD_AMOUNT_Z_LIMIT
+
+    # velocity: transfers inside the trailing time window, this one included
+    low = np.searchsorted(
+        timestamps, timestamps - settings.FRAUD_VELOCITY_SECONDS, side="left"
+    )
+    low = np.maximum(low, start)
+    velocity_score = (event_index - event_index[low] + 1) / settings.FRAUD_VELOCITY_LIMIT
+
+    # fan-out: distinct receivers among those same trailing transfers, a
+    # payout counts as one receiver of its own
+    _, codes = np.unique(receivers, return_inverse=True)
+    codes = np.where(event_size > 1, codes.max() + 1 + event_index, codes)
+    padded = np.concatenate((np.full(window, -1), codes))
+    views = sliding_window_view(padded, window + 1)
+    offsets = np.arange(-window, 1)
+    recent = np.where(offsets[None, :] >= (low - index)[:, None], views, -1)
+    recent = np.sort(recent, axis=1)
+    first = np.ones(recent.shape, dtype=bool)
+    first[:, 1:] = recent[:, 1:] != recent[:, :-1]
+    fanout_score = (first & (recent >= 0)).sum(axis=1) / settings.FRAUD_FANOUT_LIMIT
+
+    return np.maximum(np.maximum(amount_score, velocity_score), fanout_score)
+
+
+class WalletWindow:
+    __slots__ = ("timestamps", "amounts", "receivers", "loaded_at")
+
+    def __init__(self, timestamps, amounts, receivers, loaded_at=None):
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.amounts = np.asarray(amounts, dtype=np.float64)
+        self.receivers = np.asarray(receivers, dtype=object)
+        self.loaded_at = time.monotonic() if loaded_at is None else loaded_at
+
+
+class Scorer:
+    """Online scorer: keeps the last `window` transfers of recently active
+    senders in memory, bounded to `max_wallets` (least recently used first out).
+    Entries older than `ttl` are reloaded so transfers written by other
+    workers are picked up.
+
+    Windows extended by a write are held on the session and only replace the
+    cached ones once it commits, a rolled back or cancelled write leaves the
+    cache as it was."""
+
+    def __init__(self, window: int, max_wallets: int, ttl: float):
+        self.window = window
+        self.max_wallets = max_wallets
+        self.ttl = ttl
+
+        self._windows: collections.OrderedDict[str, WalletWindow] = (
+            collections.OrderedDict()
+        )
+
+    async def score(self, session: models.AsyncSession, rows: list[dict]):
+        # sets risk_score and flagged on each row, rows must carry created_at
+        pending = self._pending(session)
+
+        groups = collections.defaultdict(list)
+        for row in rows:
+            groups[row["sender"]].append(row)
+
+        now = time.monotonic()
+        windows = {}
+        for sender in groups:
+            wallet = pending.get(sender) or self._windows.get(sender)
+            if wallet is not None and now - wallet.loaded_at <= self.ttl:
+                windows[sender] = wallet
+        stale = groups.keys() - windows.keys()
+        if stale:
+            windows.update(await self._load(session, stale))
+
+        # one vectorized call per sender over its window and its new rows
+        flagged = collections.Counter()
+        for sender, group in groups.items():
+            wallet = windows[sender]
+            history = len(wallet.amounts)
+
+            timestamps = np.concatenate(
+                (wallet.timestamps, [row["created_at"].timestamp() for row in group])
+            )
+            amounts = np.concatenate((wallet.amounts, [row["amount"] for row in group]))
+            receivers = np.concatenate(
+                (
+                    wallet.receivers,
+                    np.array([row["receiver"] for row in group], dtype=object),
+                )
+            )
+
+            scores = score_arrays(timestamps, amounts, receivers, self.window)
+            for row, score in zip(group, scores[history:]):
+                row["risk_score"] = float(score)
+                row["flagged"] = row["risk_score"] >= FLAG_THRESHOLD
+                if row["flagged"]:
+                    flagged[sender] += 1
+
+            pending[sender] = WalletWindow(
+                timestamps[-self.window :],
+                amounts[-self.window :],
+                receivers[-self.window :],
+                loaded_at=wallet.loaded_at,
+            )
+
+        # one line per call, a flagged payout batch would be thousands
+        if flagged:
+            logger.warning(
+                "flagged %d of %d transfers, by sender: %s",
+                sum(flagged.values()),
+                len(rows),
+                ", ".join(
+                    f"{sender} ({count})" for sender, count in flagged.most_common(10)
+                ),
+            )
+
+    def _pending(self, session: models.AsyncSession) -> dict[str, WalletWindow]:
+        pending = session.info.get("scoring_windows")
+        if pending is None:
+            pending = session.info["scoring_windows"] = {}
+            event.listen(session.sync_session, "after_commit", self._committed)
+            event.listen(session.sync_session, "after_rollback", self._rolled_back)
+        return pending
+
+    def _committed(self, session):
+        pending = session.info["scoring_windows"]
+        for sender, wallet in pending.items():
+            self._windows[sender] = wallet
+            self._windows.move_to_end(sender)
+        pending.clear()
+
+        while len(self._windows) > self.max_wallets:
+            self._windows.popitem(last=False)
+
+    def _rolled_back(self, session):
+        session.info["scoring_windows"].clear()
+
+    async def _load(
+        self, session: models.AsyncSession, senders: set[str]
+    ) -> dict[str, WalletWindow]:
+        # the last `window` transfers of every sender, each read from the
+        # (sender, created_at, id) index and bounded by `window`
+        history = {sender: [] for sender in senders}
+        for stmt in self._recent_statements(session, sorted(senders)):
+            for row in (await session.exec(stmt)).all():
+                history[row.sender].append(row)
+
+        windows = {}
+        for sender, transfers in history.items():
+            transfers.sort(key=lambda row: (row.created_at, row.id))
+            windows[sender] = WalletWindow(
+                [row.created_at.timestamp() for row in transfers],
+                [row.amount for row in transfers],
+                [row.receiver for row in transfers],
+            )
+        return windows
+
+    def _recent_statements(self, session: models.AsyncSession, senders: list[str]):
+        transaction = models.DBTransaction
+
+        def recent(sender):
+            return (
+                select(
+                    transaction.id,
+                    transaction.receiver,
+                    transaction.amount,
+                    transaction.created_at,
+                )
+                .where(transaction.sender == sender)
+                .order_by(transaction.created_at.desc(), transaction.id.desc())
+                .limit(self.window)
+            )
+
+        if session.bind.dialect.name == "postgresql":
+            # one LATERAL subquery per sender of a VALUES list
+            sender_list = values(column("sender", String), name="senders").data(
+                [(sender,) for sender in senders]
+            )
+            transfers = recent(sender_list.c.sender).lateral("transfers")
+            yield select(sender_list.c.sender, *transfers.c).join(transfers, true())
+            return
+
+        # no LATERAL in SQLite, a UNION ALL of the per-sender queries instead
+        for start in range(0, len(senders), LOAD_CHUNK_SIZE):
+            parts = [
+                select(literal(sender).label("sender"), *recent(sender).subquery().c)
+                for sender in senders[start : start + LOAD_CHUNK_SIZE]
+            ]
+            yield union_all(*parts)
+
+
+async def rescore(session: models.AsyncSession) -> int:
+    # Batch mode: walks the ledger ordered by (sender, created_at, id) in
+    # chunks, scores each sender's run with score_arrays, carrying the last
+    # `window` transfers of a sender across chunk boundaries. The caller commits.
+    window = settings.FRAUD_WINDOW_SIZE
+    columns = (
+        models.DBTransaction.id,
+        models.DBTransaction.sender,
+        models.DBTransaction.receiver,
+        models.DBTransaction.amount,
+        models.DBTransaction.created_at,
+    )
+    order = (
+        models.DBTransaction.sender,
+        models.DBTransaction.created_at,
+        models.DBTransaction.id,
+    )
+
+    last_key = None
+    tail_sender, tail = None, None
+    count = 0
+    while True:
+        stmt = select(*columns).order_by(*order).limit(RESCORE_CHUNK_SIZE)
+        if last_key:
+            stmt = stmt.where(tuple_(*order) > tuple_(*last_key))
+        rows = (await session.exec(stmt)).all()
+        if not rows:
+            break
+
+        updates = []
+        for sender, group in itertools.groupby(rows, key=lambda row: row.sender):
+            group = list(group)
+            timestamps = np.array([row.created_at.timestamp() for row in group])
+            amounts = np.array([row.amount for row in group], dtype=np.float64)
+            receivers = np.array([row.receiver for row in group], dtype=object)
+
+            carried = 0
+            if tail_sender == sender:
+                carried = len(tail[0])
+                timestamps = np.concatenate((tail[0], timestamps))
+                amounts = np.concatenate((tail[1], amounts))
+                receivers = np.concatenate((tail[2], receivers))
+
+            scores = score_arrays(timestamps, amounts, receivers, window)[carried:]
+            updates.extend(
+                dict(
+                    id=row.id,
+                    risk_score=float(score),
+                    flagged=bool(score >= FLAG_THRESHOLD),
+                )
+                for row, score in zip(group, scores)
+            )
+
+            tail_sender = sender
+            tail = (timestamps[-window:], amounts[-window:], receivers[-window:])
+
+        # bulk UPDATE by primary key, executed as one executemany
+        await session.exec(update(models.DBTransaction), params=updates)
+
+        last_row = rows[-1]
+        last_key = (last_row.sender, last_row.created_at, last_row.id)
+        count += len(rows)
+        logger.info("rescored %d transactions", count)
+
+    return count
+
+
+scorer = Scorer(
+    window=settings.FRAUD_WINDOW_SIZE,
+    max_wallets=settings.FRAUD_MAX_WALLETS,
+    ttl=settings.FRAUD_STATE_TTL_SECONDS,
+)
@@ -1,4 +1,6 @@
+import collections
 import datetime
+import time
 from typing import Any, Union
 
 import jwt
@@ -11,6 +13,54 @@ ALGORITHM = "HS256"
 settings = config.get_settings()
 
 
+class TokenVersions:
+    """Current token version per user as last read from the database, kept
+    for `ttl` seconds (least recently used out past `max_users`). A version
+    bumped by any worker is enforced by every worker within `ttl`."""
+
+    def __init__(self, ttl: float, max_users: int):
+        self.ttl = ttl
+        self.max_users = max_users
+
+        self._versions: collections.OrderedDict[int, tuple[int, float]] = (
+            collections.OrderedDict()
+        )
+
+    def get(self, user_id: int) -> int | None:
+        entry = self._versions.get(user_id)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        self._versions.move_to_end(user_id)
+        return entry[0]
+
+    def set(self, user_id: int, token_version: int):
+        self._versions[user_id] = (token_version, time.monotonic())
+        self._versions.move_to_end(user_id)
+        if len(self._versions) > self.max_users:
+            self._versions.popitem(last=False)
+
+
+token_versions = TokenVersions(
+    ttl=settings.TOKEN_VERSION_CACHE_SECONDS,
+    max_users=settings.TOKEN_VERSION_CACHE_MAX_USERS,
+)
+
+
+def user_claims(user) -> dict:
+    return {
+        "sub": str(user.id),
+        "rol": user.role_mask,
+        "sts": user.status,
+        "ver": user.token_version,
+    }
+
+
+def revoke_tokens(user_id: int, token_version: int):
+    # this worker enforces the new version at once, the others on expiry of
+    # their cached version
+    token_versions.set(user_id, max(token_version, token_versions.get(user_id) or 0))
+
+
 def create_access_token(data: dict, expires_delta: datetime.timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -0,0 +1,182 @@
+"""Opt-in span tracing (TRACING_ENABLED) with a local JSON lines exporter.
+
+Spans nest through a context variable, so a request's DB, bcrypt and
+serialization spans carry the trace id of its http.request span. With
+tracing disabled `span()` yields None and records nothing.
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+
+from fastapi.responses import JSONResponse
+
+from . import config
+
+settings = config.get_settings()
+
+current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "attributes",
+        "start",
+        "_started",
+        "_token",
+    )
+
+    def __init__(self, name: str, attributes: dict, activate: bool = True):
+        parent = current_span.get()
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.start = time.time()
+        self._started = time.perf_counter()
+        # an active span is the parent of the spans started inside it
+        self._token = current_span.set(self) if activate else None
+
+    def end(self, error: BaseException | None = None):
+        duration = time.perf_counter() - self._started
+        if self._token is not None:
+            current_span.reset(self._token)
+        if error is not None:
+            self.attributes["error"] = repr(error)
+
+        exporter.export(
+            dict(
+                name=self.name,
+                trace_id=self.trace_id,
+                span_id=self.span_id,
+                parent_id=self.parent_id,
+                start=self.start,
+                duration_ms=duration * 1000,
+                pid=os.getpid(),
+                attributes=self.attributes,
+            )
+        )
+
+
+def start_span(name: str, **attributes) -> Span | None:
+    # for hooks that cannot wrap a block, the caller ends the span; it never
+    # becomes the current span as the hooks may run in another context
+    if not settings.TRACING_ENABLED:
+        return None
+    return Span(name, attributes, activate=False)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    if not settings.TRACING_ENABLED:
+        yield None
+        return
+
+    current = Span(name, attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    current.end()
+
+
+class JsonLinesExporter:
+    """Appends finished spans to a file, one JSON object per line. Writes
+    happen on a background thread, started per process on first use so it
+    survives the runner's fork."""
+
+    def __init__(self, path: str, max_queued: int = 10_000):
+        self.path = path
+        self._queue: queue.Queue = queue.Queue(max_queued)
+        self._pid = None
+
+    def export(self, record: dict):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._queue = queue.Queue(self._queue.maxsize)
+            threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # tracing must never slow the request down
+            pass
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                records = [self._queue.get()]
+                while not self._queue.empty():
+                    records.append(self._queue.get_nowait())
+                f.write("".join(json.dumps(r, default=str) + "\n" for r in records))
+                f.flush()
+
+
+exporter = JsonLinesExporter(settings.TRACE_EXPORT_PATH)
+
+
+def instrument_engine(engine):
+    from sqlalchemy import event
+
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._trace_span = start_span(
+            "db.query", statement=statement[:200], executemany=executemany
+        )
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if getattr(context, "_trace_span", None):
+            context._trace_span.end()
+            context._trace_span = None
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        context = exception_context.execution_context
+        if context is not None and getattr(context, "_trace_span", None):
+            context._trace_span.end(exception_context.original_exception)
+            context._trace_span = None
+
+
+class TracedJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with span("http.serialize"):
+            return super().render(content)
+
+
+class TracingMiddleware:
+    """Opens the http.request root span of every request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {}
+
+        async def traced_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        with span("http.request", method=scope["method"], path=scope["path"]) as root:
+            await self.app(scope, receive, traced_send)
+            root.attributes["status"] = status.get("code")
@@ -0,0 +1,76 @@
+import os
+
+# settings are read at import time, before any digimon module is imported
+os.environ.setdefault("SQLDB_URL", "sqlite+aiosqlite://")
+os.environ.setdefault("SECRET_KEY", "test-secret-key-of-at-least-32-bytes")
+os.environ.setdefault("FRAUD_SCORING", "false")
+
+import httpx
+import pytest_asyncio
+
+from digimon import config, main, models, partitions, security
+
+
+@pytest_asyncio.fixture
+async def session(tmp_path):
+    models.init_db(
+        config.Settings(SQLDB_URL=f"sqlite+aiosqlite:///{tmp_path}/test.sqlite")
+    )
+    models.engine.echo = False
+    async with models.engine.begin() as connection:
+        await connection.run_sync(partitions.create_tables)
+
+    async with models.create_session() as session:
+        yield session
+
+    await models.close_session()
+
+
+@pytest_asyncio.fixture
+async def wallets():
+    # works next to either the session or the client fixture
+    async def create(**balances):
+        async with models.create_session() as session:
+            for owner, balance in balances.items():
+                session.add(models.DBWallet(owner=owner, balance=balance))
+            await session.commit()
+
+    return create
+
+
+@pytest_asyncio.fixture
+async def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLDB_URL", f"sqlite+aiosqlite:///{tmp_path}/test.sqlite")
+    monkeypatch.setenv("ADMISSION_CONTROL", "false")
+    # user ids repeat across the per-test databases
+    monkeypatch.setattr(security, "token_versions", security.TokenVersions(30, 100))
+
+    app = main.create_app()
+    models.engine.echo = False
+    async with models.engine.begin() as connection:
+        await connection.run_sync(partitions.create_tables)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+    await models.close_session()
+
+
+async def create_user(username: str, roles: list[str] = ["user"]) -> dict:
+    # the user and the Authorization header of an access token for it
+    async with models.create_session() as session:
+        user = models.DBUser(
+            username=username,
+            email=f"{username}@example.com",
+            first_name=username,
+            last_name=username,
+            password="",
+            role_mask=models.encode_roles(roles),
+        )
+        session.add(user)
+        await session.commit()
+        await session.refresh(user)
+
+    token = security.create_access_token(data=security.user_claims(user))
+    return {"Authorization": f"Bearer {token}"}
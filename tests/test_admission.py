@@ -0,0 +1,28 @@
+from digimon import admission, config
+
+
+def middleware(**settings) -> admission.AdmissionMiddleware:
+    return admission.AdmissionMiddleware(None, config.Settings(**settings))
+
+
+def scope(peer: str, forwarded: str | None = None) -> dict:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return dict(type="http", headers=headers, client=(peer, 1234))
+
+
+def test_rate_limit_off_by_default():
+    assert middleware().rate_limiter is None
+    assert middleware(RATE_LIMIT_PER_SECOND=5).rate_limiter is not None
+
+
+def test_forwarded_for_only_from_trusted_proxies():
+    limiter = middleware(TRUSTED_PROXIES=["10.0.0.0/8"])
+
+    assert limiter.client_key(scope("10.0.0.5", "1.1.1.1")) == "ip:1.1.1.1"
+    # a client cannot pick its own key through a spoofed leftmost hop
+    assert limiter.client_key(scope("10.0.0.5", "6.6.6.6, 1.1.1.1")) == "ip:1.1.1.1"
+    assert (
+        limiter.client_key(scope("10.0.0.5", "1.1.1.1, 10.0.0.7")) == "ip:1.1.1.1"
+    )
+    assert limiter.client_key(scope("2.2.2.2", "1.1.1.1")) == "ip:2.2.2.2"
+    assert limiter.client_key(scope("10.0.0.5")) == "ip:10.0.0.5"
@@ -0,0 +1,121 @@
+import datetime
+
+import pytest
+from sqlmodel import select
+
+from digimon import archive, models, partitions, rollups
+
+from .conftest import create_user
+
+
+@pytest.fixture(autouse=True)
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive.settings, "ARCHIVE_DIR", str(tmp_path / "archive"))
+
+
+async def add_transactions(session, *created_at):
+    rows = [
+        dict(sender="w1", receiver="w2", amount=10.0, created_at=timestamp)
+        for timestamp in created_at
+    ]
+    for row in rows:
+        session.add(models.DBTransaction(**row))
+    await rollups.apply(session, rows)
+    await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_archive_keeps_rollups_of_archived_months(session, wallets):
+    await wallets(w1=100, w2=0)
+    now = datetime.datetime.now()
+    old = partitions.add_months(partitions.month_start(now), -6)
+    await add_transactions(session, old, now)
+
+    assert archive.cutoff() is None
+    entries = await partitions.archive_closed(session, now)
+    assert [entry["count"] for entry in entries] == [1, 0, 0]
+    assert archive.cutoff() == partitions.add_months(old, 1)
+
+    assert await rollups.rebuild(session) == 1
+    await session.commit()
+
+    result = await session.exec(
+        select(models.DBWalletRollup.bucket).where(
+            models.DBWalletRollup.granularity == "day",
+            models.DBWalletRollup.direction == "out",
+        )
+    )
+    assert sorted(result.all()) == [
+        rollups.truncate(old, "day"),
+        rollups.truncate(now, "day"),
+    ]
+
+
+def archive_months(*counts):
+    # one archived month per count, from January 2024 on, ids in order
+    next_id = 1
+    for index, count in enumerate(counts):
+        month = datetime.datetime(2024, index + 1, 1)
+        with archive.MonthWriter(month, partitions.add_months(month, 1)) as writer:
+            writer.write(
+                [
+                    dict(
+                        id=next_id + i,
+                        sender="w1",
+                        receiver="w2",
+                        amount=10.0,
+                        created_at=month + datetime.timedelta(hours=i),
+                    )
+                    for i in range(count)
+                ]
+            )
+        next_id += count
+
+
+def test_read_page_counts_whole_months_from_manifest(monkeypatch):
+    archive_months(3, 4, 5)
+    read_files = []
+    read_file = archive._read_file
+
+    def tracked(entry):
+        read_files.append(entry["file"])
+        return read_file(entry)
+
+    monkeypatch.setattr(archive, "_read_file", tracked)
+
+    rows, total = archive.read_page(None, None, offset=4, limit=2)
+    assert total == 12
+    assert [row["id"] for row in rows] == [5, 6]
+    assert read_files == ["transaction-2024-02.ndjson.gz"]
+
+    # a month cut by the range has to be read to be counted
+    read_files.clear()
+    rows, total = archive.read_page(
+        datetime.datetime(2024, 3, 1, 2), None, offset=0, limit=10
+    )
+    assert total == 3
+    assert read_files == ["transaction-2024-03.ndjson.gz"]
+
+
+@pytest.mark.asyncio
+async def test_history_includes_archive_by_default(client):
+    archive_months(3)
+    headers = await create_user("admin", ["admin"])
+    async with models.create_session() as session:
+        session.add(
+            models.DBTransaction(
+                sender="w1",
+                receiver="w2",
+                amount=1.0,
+                created_at=datetime.datetime(2024, 2, 5),
+            )
+        )
+        await session.commit()
+
+    response = await client.get(
+        "/transactions", params=dict(page_size=2), headers=headers
+    )
+    body = response.json()
+
+    assert body["total_items"] == 4
+    assert [transaction["id"] for transaction in body["transactions"]] == [1, 2]
@@ -0,0 +1,11 @@
+from digimon import config, deadlines
+
+
+def test_statement_timeout_is_longest_budget():
+    settings = config.Settings(
+        REQUEST_TIMEOUT_SECONDS=10, ROUTE_TIMEOUTS={"/batch": 30, "/debug": 0}
+    )
+    assert deadlines.statement_timeout(settings) == 30
+
+    settings = config.Settings(REQUEST_TIMEOUT_SECONDS=0, ROUTE_TIMEOUTS={})
+    assert deadlines.statement_timeout(settings) is None
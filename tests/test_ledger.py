@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+from sqlmodel import select, func
+
+from digimon import ledger, models
+
+
+async def balances(session) -> dict[str, float]:
+    result = await session.exec(select(models.DBWallet.owner, models.DBWallet.balance))
+    return dict(result.all())
+
+
+async def transaction_count(session) -> int:
+    result = await session.exec(select(func.count(models.DBTransaction.id)))
+    return result.first()
+
+
+def leg(sender, receiver, amount):
+    return dict(sender=sender, receiver=receiver, amount=amount)
+
+
+def test_net_deltas_cancels_opposing_flows():
+    deltas = ledger.net_deltas([leg("a", "b", 100), leg("b", "a", 80)])
+
+    assert deltas == {"a": -20, "b": 20}
+
+
+@pytest.mark.asyncio
+async def test_all_or_nothing_checks_funds_after_netting(session, wallets):
+    await wallets(a=20, b=0)
+
+    # "a" cannot pay 100 up front, but only owes 20 once netted
+    transactions, rejected = await ledger.apply_batch(
+        session, [leg("a", "b", 100), leg("b", "a", 80)]
+    )
+    await session.commit()
+
+    assert rejected == []
+    assert len(transactions) == 2
+    assert await balances(session) == {"a": 0, "b": 20}
+    assert await transaction_count(session) == 2
+
+
+@pytest.mark.asyncio
+async def test_all_or_nothing_rejects_whole_batch(session, wallets):
+    await wallets(a=50, b=0, c=0)
+
+    transactions, rejected = await ledger.apply_batch(
+        session, [leg("a", "b", 30), leg("a", "c", 30)]
+    )
+    await session.rollback()
+
+    assert transactions == []
+    assert {transaction.reason for transaction in rejected} == {"Insufficient funds"}
+    assert await balances(session) == {"a": 50, "b": 0, "c": 0}
+    assert await transaction_count(session) == 0
+
+
+@pytest.mark.asyncio
+async def test_all_or_nothing_rejects_unknown_wallet(session, wallets):
+    await wallets(a=50, b=0)
+
+    transactions, rejected = await ledger.apply_batch(
+        session, [leg("a", "b", 10), leg("a", "missing", 10)]
+    )
+
+    assert transactions == []
+    assert [transaction.reason for transaction in rejected] == [
+        "Receiver wallet not found"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_best_effort_applies_funded_legs_in_order(session, wallets):
+    await wallets(a=50, b=0, c=0)
+
+    # "b" is funded by the first leg, the last leg overdraws "a"
+    transactions, rejected = await ledger.apply_batch(
+        session,
+        [leg("a", "b", 40), leg("b", "c", 30), leg("a", "c", 20)],
+        best_effort=True,
+    )
+    await session.commit()
+
+    assert [(t.sender, t.receiver) for t in transactions] == [("a", "b"), ("b", "c")]
+    assert [(t.sender, t.receiver, t.reason) for t in rejected] == [
+        ("a", "c", "Insufficient funds")
+    ]
+    assert await balances(session) == {"a": 10, "b": 10, "c": 30}
+    assert await transaction_count(session) == 2
+
+
+@pytest.mark.asyncio
+async def test_balance_update_bumps_versions(session, wallets):
+    await wallets(a=10, b=0)
+
+    await ledger.apply_batch(session, [leg("a", "b", 5)])
+    await session.commit()
+
+    result = await session.exec(select(models.DBWallet.version))
+    assert set(result.all()) == {2}
+
+
+@pytest.mark.asyncio
+async def test_batcher_fails_only_the_bad_row(session, wallets):
+    await wallets(a=10, b=0, c=0)
+    batcher = ledger.TransactionBatcher(max_size=10, max_delay=0.05)
+    await batcher.start()
+    try:
+        results = await asyncio.gather(
+            batcher.submit(leg("a", "b", 1)),
+            batcher.submit(leg("a", "b", None)),
+            batcher.submit(leg("a", "c", 2)),
+            return_exceptions=True,
+        )
+    finally:
+        await batcher.stop()
+
+    assert isinstance(results[0], int)
+    assert isinstance(results[1], Exception)
+    assert isinstance(results[2], int)
+    assert await transaction_count(session) == 2
+    assert await balances(session) == {"a": 7, "b": 1, "c": 2}
+
+
+@pytest.mark.asyncio
+async def test_batcher_rejects_unfunded_transaction(session, wallets):
+    await wallets(a=10, b=0)
+    batcher = ledger.TransactionBatcher(max_size=10, max_delay=0.05)
+    await batcher.start()
+    try:
+        results = await asyncio.gather(
+            batcher.submit(leg("a", "b", 8)),
+            batcher.submit(leg("a", "b", 8)),
+            return_exceptions=True,
+        )
+    finally:
+        await batcher.stop()
+
+    assert isinstance(results[0], int)
+    assert isinstance(results[1], ledger.TransactionRejected)
+    assert await balances(session) == {"a": 2, "b": 8}
+
+
+@pytest.mark.asyncio
+async def test_non_finite_amounts_are_rejected(session, wallets):
+    await wallets(a=10, b=0)
+
+    transactions, rejected = await ledger.apply_batch(
+        session,
+        [leg("a", "b", float("nan")), leg("a", "b", float("inf"))],
+        best_effort=True,
+    )
+    await session.commit()
+
+    assert transactions == []
+    assert len(rejected) == 2
+    assert await balances(session) == {"a": 10, "b": 0}
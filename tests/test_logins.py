@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+from sqlmodel import select
+
+from digimon import logins, models
+
+from .conftest import create_user
+
+
+async def login_dates() -> dict[str, datetime.datetime]:
+    async with models.create_session() as session:
+        users = (await session.exec(select(models.DBUser))).all()
+        return {user.username: user.last_login_date for user in users}
+
+
+async def user_ids(*usernames) -> list[int]:
+    ids = []
+    for username in usernames:
+        await create_user(username)
+        async with models.create_session() as session:
+            user = (
+                await session.exec(
+                    select(models.DBUser).where(models.DBUser.username == username)
+                )
+            ).one()
+            ids.append(user.id)
+    return ids
+
+
+@pytest.mark.asyncio
+async def test_flush_writes_latest_login(session):
+    alice, bob = await user_ids("alice", "bob")
+    buffer = logins.LastLoginBuffer(interval=60)
+
+    buffer.record(alice, datetime.datetime(2024, 1, 2))
+    buffer.record(alice, datetime.datetime(2024, 1, 1))
+    buffer.record(bob, datetime.datetime(2024, 1, 3))
+    await buffer.flush()
+
+    assert await login_dates() == {
+        "alice": datetime.datetime(2024, 1, 2),
+        "bob": datetime.datetime(2024, 1, 3),
+    }
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_newer_login(session, monkeypatch):
+    (alice,) = await user_ids("alice")
+    buffer = logins.LastLoginBuffer(interval=60)
+    buffer.record(alice, datetime.datetime(2024, 1, 1))
+
+    create_session = models.create_session
+
+    def failing_session():
+        # a login comes in while the failing flush is under way
+        buffer.record(alice, datetime.datetime(2024, 1, 2))
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(models, "create_session", failing_session)
+    await buffer.flush()
+    # the failed date was re-queued but did not replace the newer one
+    assert buffer._pending == {alice: datetime.datetime(2024, 1, 2)}
+
+    monkeypatch.setattr(models, "create_session", create_session)
+    await buffer.flush()
+    assert await login_dates() == {"alice": datetime.datetime(2024, 1, 2)}
+
+
+@pytest.mark.asyncio
+async def test_stop_flushes_pending_logins(session):
+    (alice,) = await user_ids("alice")
+    buffer = logins.LastLoginBuffer(interval=60)
+    await buffer.start()
+
+    buffer.record(alice, datetime.datetime(2024, 1, 1))
+    await buffer.stop()
+
+    assert await login_dates() == {"alice": datetime.datetime(2024, 1, 1)}
@@ -0,0 +1,81 @@
+import sqlite3
+
+import pytest
+from sqlmodel import select
+
+from digimon import config, migrations, models
+
+# the tables as create_all left them before schema versioning
+PRE_VERSIONING_SCHEMA = """
+CREATE TABLE users (
+    email VARCHAR NOT NULL, username VARCHAR NOT NULL,
+    first_name VARCHAR NOT NULL, last_name VARCHAR NOT NULL,
+    id INTEGER NOT NULL, password VARCHAR NOT NULL,
+    register_date DATETIME NOT NULL, updated_date DATETIME NOT NULL,
+    last_login_date DATETIME, PRIMARY KEY (id)
+);
+CREATE TABLE merchants (
+    name VARCHAR NOT NULL, description VARCHAR, tax_id VARCHAR,
+    id INTEGER NOT NULL, user_id INTEGER NOT NULL REFERENCES users (id),
+    PRIMARY KEY (id)
+);
+CREATE TABLE items (
+    name VARCHAR NOT NULL, description VARCHAR, price FLOAT NOT NULL, tax FLOAT,
+    id INTEGER NOT NULL, merchant_id INTEGER NOT NULL REFERENCES merchants (id),
+    user_id INTEGER NOT NULL REFERENCES users (id), PRIMARY KEY (id)
+);
+CREATE TABLE wallet (
+    id INTEGER NOT NULL, owner VARCHAR NOT NULL, balance FLOAT NOT NULL,
+    PRIMARY KEY (id)
+);
+CREATE TABLE "transaction" (
+    id INTEGER NOT NULL, sender VARCHAR NOT NULL, receiver VARCHAR NOT NULL,
+    amount FLOAT NOT NULL, PRIMARY KEY (id)
+);
+INSERT INTO users VALUES
+    ('a@example.com', 'a', 'a', 'a', 1, '', '2024-01-01', '2024-01-01', NULL);
+INSERT INTO wallet VALUES (1, 'a', 10);
+INSERT INTO "transaction" VALUES (1, 'a', 'b', 5);
+"""
+
+
+@pytest.mark.asyncio
+async def test_migrate_pre_versioning_database(tmp_path):
+    path = tmp_path / "test.sqlite"
+    with sqlite3.connect(path) as connection:
+        connection.executescript(PRE_VERSIONING_SCHEMA)
+
+    models.init_db(config.Settings(SQLDB_URL=f"sqlite+aiosqlite:///{path}"))
+    models.engine.echo = False
+    try:
+        assert await migrations.migrate() == 0
+        await migrations.check()
+
+        async with models.create_session() as session:
+            user = await session.get(models.DBUser, 1)
+            assert user.roles == ["user"]
+            assert (user.status, user.token_version) == ("active", 0)
+            transaction = (await session.exec(select(models.DBTransaction))).one()
+            assert transaction.created_at is not None
+            assert (await session.get(models.DBWallet, 1)).version == 1
+    finally:
+        await models.close_session()
+
+
+@pytest.mark.asyncio
+async def test_check_accepts_compatible_newer_schema(session):
+    await migrations.migrate()
+    await migrations.check()
+
+    async def stamp(version):
+        session.add(models.DBSchemaVersion(version=version))
+        await session.commit()
+
+    # the next release migrated during a rolling deploy
+    await stamp(migrations.MAX_COMPATIBLE_SCHEMA_VERSION)
+    await migrations.check()
+    assert await migrations.migrate() == migrations.MAX_COMPATIBLE_SCHEMA_VERSION
+
+    await stamp(migrations.MAX_COMPATIBLE_SCHEMA_VERSION + 1)
+    with pytest.raises(migrations.SchemaVersionError):
+        await migrations.check()
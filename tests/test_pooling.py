@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+import pytest
+from sqlalchemy.util import greenlet_spawn
+
+from digimon import config, pooling
+
+
+@pytest.mark.asyncio
+async def test_opening_a_connection_is_not_a_wait(monkeypatch):
+    monitor = pooling.PoolWaitMonitor()
+    monkeypatch.setattr(pooling, "pool_wait", monitor)
+
+    def connect():
+        time.sleep(0.05)
+        return sqlite3.connect(":memory:")
+
+    pool = pooling.MonitoredPool(connect, pool_size=1, max_overflow=0)
+
+    def checkouts():
+        pool.connect().close()
+        assert monitor.current() == 0
+        assert pool.at_limit()
+
+        # the pool is full now, this checkout goes through the blocking get
+        pool.connect().close()
+        assert monitor.current() < 0.01
+
+    await greenlet_spawn(checkouts)
+    pool.dispose()
+
+
+def test_budget_is_split_only_between_runner_workers():
+    settings = config.Settings(SQLDB_URL="sqlite://", DB_CONNECTION_BUDGET=20)
+    assert pooling.pool_options(settings) == dict(pool_size=20, max_overflow=0)
+
+    settings = config.Settings(
+        SQLDB_URL="sqlite://", DB_CONNECTION_BUDGET=20, RUNNER_WORKERS=4
+    )
+    # one share held back for a rolling restart
+    assert pooling.pool_options(settings) == dict(pool_size=4, max_overflow=0)
@@ -0,0 +1,56 @@
+import collections
+import sys
+
+import pytest
+
+from digimon import profiling
+from digimon.routers import debug
+
+from .conftest import create_user
+
+
+def test_walk_lists_outermost_frame_first():
+    def inner():
+        return profiling.walk(sys._getframe())
+
+    def outer():
+        return inner()
+
+    frames = outer()
+    assert frames[-2:] == [
+        f"{__name__}:test_walk_lists_outermost_frame_first.<locals>.outer",
+        f"{__name__}:test_walk_lists_outermost_frame_first.<locals>.inner",
+    ]
+
+
+def test_collapse_most_sampled_stack_first():
+    stacks = collections.Counter({("main", "a", "b"): 1, ("main", "a"): 3})
+
+    assert profiling.collapse(stacks) == "main;a 3\nmain;a;b 1\n"
+
+
+def test_one_profile_at_a_time():
+    profiler = profiling.SamplingProfiler(0.001)
+    with profiler._lock:
+        assert profiler.running
+        assert profiler.sample(0.01) is None
+
+    assert not profiler.running
+    assert profiler.sample(0.01) is not None
+
+
+@pytest.mark.asyncio
+async def test_profile_is_for_admins_only(client, monkeypatch):
+    monkeypatch.setattr(debug.profiler, "sample", lambda seconds: "main;a 1\n")
+    user = await create_user("user")
+    admin = await create_user("admin", ["admin"])
+
+    assert (await client.get("/debug/profile")).status_code == 401
+    assert (await client.get("/debug/profile", headers=user)).status_code == 400
+
+    response = await client.get(
+        "/debug/profile", params=dict(seconds=1), headers=admin
+    )
+    assert response.status_code == 200
+    assert response.text == "main;a 1\n"
+    assert response.headers["X-Worker-Pid"]
@@ -0,0 +1,101 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from digimon import ledger, scoring
+
+
+def rows(sender, amounts, start=datetime.datetime(2024, 1, 1)):
+    return [
+        dict(
+            sender=sender,
+            receiver=f"r{i}",
+            amount=amount,
+            created_at=start + datetime.timedelta(minutes=i),
+        )
+        for i, amount in enumerate(amounts)
+    ]
+
+
+def test_score_arrays_flags_outlier_amount():
+    amounts = np.array([10.0] * 10 + [1000.0])
+    timestamps = np.arange(len(amounts)) * 3600.0
+    receivers = np.array(["r"] * len(amounts), dtype=object)
+
+    scores = scoring.score_arrays(timestamps, amounts, receivers, window=64)
+
+    assert scores[-1] >= scoring.FLAG_THRESHOLD
+    assert scores[:-1].max() < scoring.FLAG_THRESHOLD
+
+
+@pytest.mark.asyncio
+async def test_batch_scores_match_one_by_one(session):
+    amounts = [10, 12, 11, 9, 10, 500]
+    batch = rows("a", amounts)
+    single = rows("b", amounts)
+
+    await scoring.Scorer(64, 100, 300).score(session, batch)
+    one_by_one = scoring.Scorer(64, 100, 300)
+    for row in single:
+        await one_by_one.score(session, [row])
+
+    assert [row["risk_score"] for row in batch] == [row["risk_score"] for row in single]
+
+
+@pytest.mark.asyncio
+async def test_window_kept_only_after_commit(session):
+    scorer = scoring.Scorer(64, 100, 300)
+
+    await scorer.score(session, rows("a", [10, 20]))
+    await session.rollback()
+    assert "a" not in scorer._windows
+
+    batch = rows("a", [10, 20])
+    await scorer.score(session, batch)
+    await ledger.insert_transactions(session, batch)
+    await session.commit()
+    assert list(scorer._windows["a"].amounts) == [10, 20]
+
+
+@pytest.mark.asyncio
+async def test_cache_is_bounded(session):
+    scorer = scoring.Scorer(64, 2, 300)
+
+    for sender in ("a", "b", "c"):
+        await scorer.score(session, rows(sender, [10]))
+    await session.commit()
+
+    assert list(scorer._windows) == ["b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_payout_batch_is_one_event(session, caplog):
+    # the legs of a payout batch share the time they were written at
+    payout = rows("a", [1.0] * 20)
+    for row in payout:
+        row["created_at"] = datetime.datetime(2024, 1, 1)
+    # the same transfers a second apart
+    spray = rows("b", [1.0] * 20)
+    for i, row in enumerate(spray):
+        row["created_at"] = datetime.datetime(2024, 1, 1, second=i)
+
+    with caplog.at_level("WARNING", logger="digimon.scoring"):
+        await scoring.Scorer(64, 100, 300).score(session, payout + spray)
+
+    assert not any(row["flagged"] for row in payout)
+    assert any(row["flagged"] for row in spray)
+    # one summary line for the whole call
+    assert len(caplog.records) == 1
+
+
+def test_payout_counts_once_for_velocity_and_fan_out():
+    n = 20
+    receivers = np.array([f"r{i}" for i in range(n)], dtype=object)
+    amounts = np.ones(n)
+
+    payout = scoring.score_arrays(np.zeros(n), amounts, receivers, window=64)
+    singles = scoring.score_arrays(np.arange(n, dtype=float), amounts, receivers)
+
+    assert payout.max() < scoring.FLAG_THRESHOLD
+    assert singles[-1] >= scoring.FLAG_THRESHOLD
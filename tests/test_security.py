@@ -0,0 +1,28 @@
+import pytest
+from sqlmodel import update
+
+from digimon import models, security
+
+from .conftest import create_user
+
+
+@pytest.mark.asyncio
+async def test_token_version_bumped_elsewhere_revokes_token(client):
+    headers = await create_user("root", roles=["admin"])
+
+    response = await client.delete("/transactions/999", headers=headers)
+    assert response.status_code == 404
+
+    # as if another worker changed the password
+    async with models.create_session() as session:
+        await session.exec(
+            update(models.DBUser).values(token_version=models.DBUser.token_version + 1)
+        )
+        await session.commit()
+
+    response = await client.delete("/transactions/999", headers=headers)
+    assert response.status_code == 404
+
+    security.token_versions.ttl = 0
+    response = await client.delete("/transactions/999", headers=headers)
+    assert response.status_code == 401
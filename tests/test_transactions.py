@@ -0,0 +1,149 @@
+import pytest
+
+from digimon import models
+
+from .conftest import create_user
+
+
+def batch(*legs, mode="all_or_nothing"):
+    return dict(
+        transactions=[
+            dict(sender=sender, receiver=receiver, amount=amount)
+            for sender, receiver, amount in legs
+        ],
+        mode=mode,
+    )
+
+
+@pytest.mark.asyncio
+async def test_batch_requires_authentication(client, wallets):
+    await wallets(w1=100, w2=0)
+
+    response = await client.post(
+        "/transactions/batch", json=batch(("w1", "w2", 50), mode="best_effort")
+    )
+
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_batch_only_debits_own_wallets(client, wallets):
+    headers = await create_user("alice")
+    await wallets(alice=100, bob=100)
+
+    response = await client.post(
+        "/transactions/batch", json=batch(("bob", "alice", 50)), headers=headers
+    )
+    assert response.status_code == 403
+
+    response = await client.post(
+        "/transactions/batch", json=batch(("alice", "bob", 50)), headers=headers
+    )
+    assert response.status_code == 200
+    assert len(response.json()["transactions"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_admin_debits_any_wallet(client, wallets):
+    headers = await create_user("root", roles=["admin"])
+    await wallets(alice=100, bob=0)
+
+    response = await client.post(
+        "/transactions/batch", json=batch(("alice", "bob", 50)), headers=headers
+    )
+
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_batch_size_is_capped(client):
+    headers = await create_user("root", roles=["admin"])
+
+    response = await client.post(
+        "/transactions/batch",
+        json=batch(*[("a", "b", 1)] * (models.BATCH_MAX_SIZE + 1)),
+        headers=headers,
+    )
+
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_single_transaction_moves_balances(client, wallets):
+    headers = await create_user("alice")
+    await wallets(alice=100, bob=0)
+
+    response = await client.post(
+        "/transactions", json=dict(sender="alice", receiver="bob", amount=30)
+    )
+    assert response.status_code == 401
+
+    response = await client.post(
+        "/transactions",
+        json=dict(sender="bob", receiver="alice", amount=30),
+        headers=headers,
+    )
+    assert response.status_code == 403
+
+    response = await client.post(
+        "/transactions",
+        json=dict(sender="alice", receiver="bob", amount=300),
+        headers=headers,
+    )
+    assert response.status_code == 400
+
+    response = await client.post(
+        "/transactions",
+        json=dict(sender="alice", receiver="bob", amount=30),
+        headers=headers,
+    )
+    assert response.status_code == 200
+    transaction_id = response.json()["id"]
+
+    async with models.create_session() as session:
+        assert (await session.get(models.DBWallet, 1)).balance == 70
+        assert (await session.get(models.DBWallet, 2)).balance == 30
+
+    response = await client.get(f"/transactions/{transaction_id}", headers=headers)
+    assert response.status_code == 200
+    response = await client.get(
+        f"/transactions/{transaction_id}", headers=await create_user("eve")
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_ledger_list_requires_admin(client):
+    assert (await client.get("/transactions")).status_code == 401
+
+    headers = await create_user("alice")
+    assert (await client.get("/transactions", headers=headers)).status_code == 400
+
+    headers = await create_user("root", roles=["admin"])
+    assert (await client.get("/transactions", headers=headers)).status_code == 200
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("amount", ["NaN", "Infinity", "-Infinity"])
+async def test_non_finite_amount_is_rejected(client, wallets, amount):
+    headers = await create_user("alice")
+    await wallets(alice=100, bob=0)
+    # not valid JSON strictly speaking, but accepted by json.loads
+    body = f'{{"sender": "alice", "receiver": "bob", "amount": {amount}}}'
+
+    response = await client.post(
+        "/transactions",
+        content=body,
+        headers={**headers, "Content-Type": "application/json"},
+    )
+    assert response.status_code == 422
+
+    response = await client.post(
+        "/transactions/batch",
+        content=f'{{"transactions": [{body}]}}',
+        headers={**headers, "Content-Type": "application/json"},
+    )
+    assert response.status_code == 422
+
+    async with models.create_session() as session:
+        assert (await session.get(models.DBWallet, 1)).balance == 100
@@ -0,0 +1,32 @@
+import bcrypt
+import pytest
+from sqlmodel import select
+
+from digimon import models
+
+from .conftest import create_user
+
+
+@pytest.mark.asyncio
+async def test_change_password_revokes_tokens(client):
+    headers = await create_user("alice")
+    async with models.create_session() as session:
+        user = (await session.exec(select(models.DBUser))).one()
+        await user.set_password("old-password")
+        session.add(user)
+        await session.commit()
+
+    response = await client.put(
+        "/users/1/change_password",
+        json=dict(current_password="old-password", new_password="new-password"),
+        headers=headers,
+    )
+    assert response.status_code == 200
+
+    async with models.create_session() as session:
+        user = await session.get(models.DBUser, 1)
+        assert bcrypt.checkpw(b"new-password", user.password.encode())
+        assert (user.version, user.token_version) == (2, 1)
+
+    response = await client.get("/users/me", headers=headers)
+    assert response.status_code == 401
@@ -0,0 +1,98 @@
+import pytest
+
+from .conftest import create_user
+
+
+@pytest.mark.asyncio
+async def test_wallet_changes_require_admin(client):
+    response = await client.post("/wallets", json=dict(owner="a", balance=1000))
+    assert response.status_code == 401
+
+    headers = await create_user("alice")
+    response = await client.post(
+        "/wallets", json=dict(owner="a", balance=1000), headers=headers
+    )
+    assert response.status_code == 400
+
+    headers = await create_user("root", roles=["admin"])
+    response = await client.post(
+        "/wallets", json=dict(owner="a", balance=1000), headers=headers
+    )
+    assert response.status_code == 200
+    wallet_id = response.json()["id"]
+
+    response = await client.put(
+        f"/wallets/{wallet_id}", json=dict(owner="a", balance=5)
+    )
+    assert response.status_code == 401
+    response = await client.delete(f"/wallets/{wallet_id}")
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_wallet_owner_is_unique(client):
+    headers = await create_user("root", roles=["admin"])
+
+    await client.post("/wallets", json=dict(owner="a", balance=0), headers=headers)
+    response = await client.post(
+        "/wallets", json=dict(owner="a", balance=0), headers=headers
+    )
+
+    assert response.status_code == 409
+
+
+@pytest.mark.asyncio
+async def test_wallet_reads_require_owner_or_admin(client, wallets):
+    await wallets(alice=100, bob=0)
+
+    assert (await client.get("/wallets")).status_code == 401
+    headers = await create_user("alice")
+    assert (await client.get("/wallets", headers=headers)).status_code == 400
+
+    assert (await client.get("/wallets/1", headers=headers)).status_code == 200
+    assert (await client.get("/wallets/2", headers=headers)).status_code == 404
+    assert (await client.get("/wallets/2/stats", headers=headers)).status_code == 404
+
+    headers = await create_user("root", roles=["admin"])
+    assert (await client.get("/wallets", headers=headers)).status_code == 200
+    assert (await client.get("/wallets/2/stats", headers=headers)).status_code == 200
+    assert (await client.get("/wallets/9/stats", headers=headers)).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_ledger_edits_update_rollups(client, wallets):
+    headers = await create_user("root", roles=["admin"])
+    await wallets(alice=1000, bob=0)
+
+    for amount in (5, 7):
+        response = await client.post(
+            "/transactions",
+            json=dict(sender="alice", receiver="bob", amount=amount),
+            headers=headers,
+        )
+    transaction_id = response.json()["id"]
+
+    async def outgoing():
+        response = await client.get("/wallets/1/stats", headers=headers)
+        fields = ("count", "total", "min_amount", "max_amount")
+        return [
+            tuple(bucket[field] for field in fields)
+            for bucket in response.json()["outgoing"]
+        ]
+
+    assert await outgoing() == [(2, 12, 5, 7)]
+
+    response = await client.put(
+        f"/transactions/{transaction_id}",
+        json=dict(sender="alice", receiver="bob", amount=500),
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert await outgoing() == [(2, 505, 5, 500)]
+
+    response = await client.delete(f"/transactions/{transaction_id}", headers=headers)
+    assert response.status_code == 200
+    assert await outgoing() == [(1, 5, 5, 5)]
+
+    await client.delete(f"/transactions/{transaction_id - 1}", headers=headers)
+    assert await outgoing() == []